@@ -0,0 +1,141 @@
+import os
+import re
+import tomllib
+from typing import Dict, List, Optional
+
+DEFAULT_ACCOUNT = 'default'
+
+# 設定檔中的 key 與對應的環境變數；設定檔沒有寫的欄位依序使用 [defaults] 與環境變數（NO_ENV_FALLBACK 除外）
+FIELDS = {
+    'api_url': 'JOPLIN_DATA_API_URL',
+    'api_token': 'JOPLIN_DATA_API_TOKEN',
+    'server_url': 'JOPLIN_SERVER_URL',
+    'user': 'JOPLIN_USERNAME',
+    'password': 'JOPLIN_PASSWORD',
+    'readeck_url': 'READECK_URL',
+    'readeck_token': 'READECK_TOKEN',
+    'instapaper_username': 'INSTAPAPER_USERNAME',
+    'instapaper_password': 'INSTAPAPER_PASSWORD',
+    'notes_url': 'NOTES_URL',
+    'notes_url_prefix': 'NOTES_URL_PREFIX',
+    'inbox': 'INBOX',
+    'concurrency': 'SYNC_CONCURRENCY',
+}
+REQUIRED = ('api_url', 'api_token', 'server_url', 'user', 'password', 'notes_url', 'inbox')
+# 帳號的身分、密碼與發佈目的地：多帳號時不使用環境變數（單一帳號的設定），
+# 只能寫在帳號、[defaults] 或以 ${VAR} 明確引用，避免筆記發佈到別人的 Readeck / Instapaper
+NO_ENV_FALLBACK = ('api_token', 'user', 'password', 'readeck_url', 'readeck_token',
+                   'instapaper_username', 'instapaper_password')
+ENV_REFERENCE = re.compile(r'\$\{(\w+)\}')
+
+
+class Account:
+    """
+    一個 Joplin 帳號的連線設定與發佈目的地。
+
+    名稱為 default 的帳號（只用環境變數設定時）狀態 key 不加前綴，與單一帳號時的資料相容；
+    其他帳號的 cursor、pending、checkpoint 等以 key:name 分開保存。
+    """
+
+    def __init__(self, name: str = DEFAULT_ACCOUNT, api_url: Optional[str] = None, api_token: Optional[str] = None,
+                 server_url: Optional[str] = None, user: Optional[str] = None, password: Optional[str] = None,
+                 readeck_url: Optional[str] = None, readeck_token: Optional[str] = None,
+                 instapaper_username: Optional[str] = None, instapaper_password: Optional[str] = None,
+                 notes_url: Optional[str] = None, notes_url_prefix: Optional[str] = None,
+                 inbox: Optional[str] = None, concurrency: int = 0):
+        self.name = name
+        self.api_url = api_url
+        self.api_token = api_token
+        self.server_url = server_url
+        self.user = user
+        self.password = password
+        self.readeck_url = readeck_url
+        self.readeck_token = readeck_token
+        self.instapaper_username = instapaper_username
+        self.instapaper_password = instapaper_password
+        self.notes_url = notes_url
+        self.notes_url_prefix = notes_url_prefix or ''
+        self.inbox = inbox
+        self.concurrency = int(concurrency)
+
+    @property
+    def namespace(self) -> str:
+        return '' if self.name == DEFAULT_ACCOUNT else self.name
+
+    def key(self, base: str) -> str:
+        """此帳號在 state store 中的 key。"""
+        return f"{base}:{self.namespace}" if self.namespace else base
+
+    def note_url(self, note_id: str) -> str:
+        return f"{self.notes_url}{self.notes_url_prefix}/n/{note_id}"
+
+    def __repr__(self):
+        return f"Account({self.name!r})"
+
+
+def account_from_env(name: str = DEFAULT_ACCOUNT) -> Account:
+    """只用環境變數（.env）設定的單一帳號。"""
+    values = {field: os.getenv(env) for field, env in FIELDS.items() if os.getenv(env) is not None}
+    return Account(name, **values)
+
+
+def load_accounts(path: str) -> List[Account]:
+    """
+    讀取多帳號設定檔（TOML）。
+
+        [defaults]
+        readeck_url = "https://readeck.example.com"
+
+        [[accounts]]
+        name = "dany"
+        api_url = "http://joplin-dany:41184"
+        api_token = "${JOPLIN_TOKEN_DANY}"
+        ...
+
+    字串中的 ${VAR} 以環境變數展開，密碼與 token 可放在 Secret 中。NO_ENV_FALLBACK 的欄位不會
+    使用單一帳號的環境變數；沒有 readeck_token 或 Instapaper 帳密的帳號不發佈到該目的地。
+
+    Raises:
+        ValueError: 設定檔格式錯誤、帳號名稱重複、缺少必要欄位、引用未設定的環境變數，
+            或目的地設定不完整（有 readeck_token 沒有 readeck_url、Instapaper 帳密只有一個）
+    """
+    with open(path, 'rb') as f:
+        config = tomllib.load(f)
+
+    defaults = config.get('defaults', {})
+    accounts = []
+    names = set()
+    for entry in config.get('accounts', []):
+        name = entry.get('name')
+        if not name:
+            raise ValueError(f"{path}: every account needs a name")
+        if name in names:
+            raise ValueError(f"{path}: duplicate account {name}")
+        names.add(name)
+
+        values: Dict[str, object] = {}
+        for field, env in FIELDS.items():
+            fallback = None if field in NO_ENV_FALLBACK else os.getenv(env)
+            value = entry.get(field, defaults.get(field, fallback))
+            if isinstance(value, str):
+                unset = [var for var in ENV_REFERENCE.findall(value) if var not in os.environ]
+                if unset:
+                    raise ValueError(f"{path}: account {name} {field} references unset {', '.join(unset)}")
+                value = os.path.expandvars(value)
+            if value is not None:
+                values[field] = value
+        unknown = set(entry) - set(FIELDS) - {'name'}
+        if unknown:
+            raise ValueError(f"{path}: unknown keys for account {name}: {', '.join(sorted(unknown))}")
+        missing = [field for field in REQUIRED if not values.get(field)]
+        if missing:
+            raise ValueError(f"{path}: account {name} is missing {', '.join(missing)}")
+        if values.get('readeck_token') and not values.get('readeck_url'):
+            raise ValueError(f"{path}: account {name} has readeck_token but no readeck_url")
+        if bool(values.get('instapaper_username')) != bool(values.get('instapaper_password')):
+            raise ValueError(f"{path}: account {name} needs both instapaper_username and instapaper_password")
+        accounts.append(Account(name, **values))
+
+    if not accounts:
+        raise ValueError(f"{path}: no [[accounts]] defined")
+    return accounts
@@ -0,0 +1,321 @@
+"""
+本機替身伺服器：Joplin Data API、Joplin Server、Readeck、Instapaper。
+
+每個服務都可以設定延遲與錯誤率，並記錄每個 endpoint 收到的請求數，
+供 run_bench.py 驅動 note2read.py 做離線效能測試。
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+_ID_SEGMENT = re.compile(r'/[0-9A-Za-z]{16,}(?=/|$)')
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex
+
+
+class FakeService:
+    """
+    一個替身服務的共用部分：延遲、錯誤率、請求計數與 HTTP server 生命週期。
+
+    Args:
+        name (str): 服務名稱
+        latency (float): 每個請求的延遲秒數
+        error_rate (float): 回傳 503 的機率（0~1）
+        throttle_rate (float): 回傳 429（Retry-After: 1）的機率（0~1）
+    """
+
+    def __init__(self, name: str, latency: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def route(self, method: str, path: str, query: Dict, body: Dict):
+        """子類別實作，回傳 (status, JSON 物件) 或 (status, JSON 物件, headers)。"""
+        return 404, {'error': 'not found'}
+
+    def handle(self, method: str, path: str, query: Dict, body: Dict):
+        key = f"{method} {_ID_SEGMENT.sub('/{id}', path)}"
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            return 429, {'error': 'too many requests'}
+        if self.error_rate and random.random() < self.error_rate:
+            return 503, {'error': 'injected failure'}
+        with self.lock:
+            return self.route(method, path, query, body)
+
+    def start(self) -> 'FakeService':
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self, method):
+                parsed = urlparse(self.path)
+                query = {k: v[0] if len(v) == 1 else v for k, v in parse_qs(parsed.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                body = {}
+                if raw:
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        body = json.loads(raw)
+                    else:
+                        body = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+                status, payload, *extra = service.handle(method, parsed.path, query, body)
+                data = json.dumps(payload).encode() if status != 204 else b''
+                self.send_response(status)
+                if status == 429:
+                    self.send_header('Retry-After', '1')
+                for name, value in (extra[0] if extra else {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def _page(items, query, default_limit=100):
+    limit = int(query.get('limit', default_limit))
+    page = int(query.get('page', 1))
+    start = (page - 1) * limit
+    chunk = items[start:start + limit]
+    return {'items': chunk, 'has_more': start + limit < len(items)}
+
+
+class FakeJoplinDataAPI(FakeService):
+    """Joplin Data API（/notes、/folders、/tags、/tags/{id}/notes、/events）。"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0):
+        super().__init__('joplin', latency, error_rate, throttle_rate)
+        self.folders: Dict[str, Dict] = {}
+        self.tags: Dict[str, Dict] = {}
+        self.notes: Dict[str, Dict] = {}
+        # 以 dict 保持插入（created_time）順序，移動筆記只需刪除與附加
+        self.folder_notes: Dict[str, Dict[str, None]] = {}
+        self.tag_notes: Dict[str, Dict[str, None]] = {}
+        self.events = []
+
+    def add_folder(self, title: str) -> str:
+        folder_id = new_id()
+        self.folders[folder_id] = {'id': folder_id, 'title': title, 'parent_id': ''}
+        self.folder_notes[folder_id] = {}
+        return folder_id
+
+    def add_tag(self, title: str) -> str:
+        tag_id = new_id()
+        self.tags[tag_id] = {'id': tag_id, 'title': title}
+        self.tag_notes[tag_id] = {}
+        return tag_id
+
+    def add_note(self, title: str, parent_id: str, created_time: int) -> str:
+        note_id = new_id()
+        self.notes[note_id] = {'id': note_id, 'title': title, 'parent_id': parent_id,
+                               'created_time': created_time, 'body': ''}
+        self.folder_notes.setdefault(parent_id, {})[note_id] = None
+        self._event(note_id, 1)
+        return note_id
+
+    def tag_note(self, tag_id: str, note_id: str):
+        self.tag_notes.setdefault(tag_id, {})[note_id] = None
+
+    def notes_in(self, folder_id: str) -> int:
+        return len(self.folder_notes.get(folder_id, {}))
+
+    def _event(self, note_id: str, event_type: int):
+        self.events.append({'id': len(self.events) + 1, 'item_type': 1, 'item_id': note_id, 'type': event_type})
+
+    def _fields(self, note: Dict, query: Dict) -> Dict:
+        fields = query.get('fields')
+        if not fields:
+            return note
+        return {f.strip(): note.get(f.strip()) for f in fields.split(',')}
+
+    def _note_page(self, note_ids, query):
+        limit = int(query.get('limit', 100))
+        page = int(query.get('page', 1))
+        start = (page - 1) * limit
+        chunk = []
+        for i, note_id in enumerate(note_ids):
+            if i >= start + limit + 1:
+                break
+            if i >= start:
+                chunk.append(note_id)
+        has_more = len(chunk) > limit
+        return {'items': [self._fields(self.notes[n], query) for n in chunk[:limit]], 'has_more': has_more}
+
+    def route(self, method, path, query, body):
+        parts = path.strip('/').split('/')
+
+        if parts == ['events']:
+            if 'cursor' not in query:
+                return 200, {'items': [], 'has_more': False, 'cursor': str(len(self.events))}
+            cursor = int(query['cursor'])
+            items = self.events[cursor:cursor + 100]
+            return 200, {'items': items, 'has_more': cursor + 100 < len(self.events),
+                         'cursor': str(cursor + len(items))}
+
+        if parts[0] in ('folders', 'tags') and len(parts) == 1:
+            store = self.folders if parts[0] == 'folders' else self.tags
+            if method == 'POST':
+                item_id = self.add_folder(body['title']) if parts[0] == 'folders' else self.add_tag(body['title'])
+                return 200, store[item_id]
+            return 200, _page(list(store.values()), query)
+
+        if parts[0] == 'folders' and len(parts) == 3 and parts[2] == 'notes':
+            return 200, self._note_page(self.folder_notes.get(parts[1], {}), query)
+
+        if parts[0] == 'tags' and len(parts) == 3 and parts[2] == 'notes':
+            if method == 'POST':
+                if body['id'] in self.tag_notes.setdefault(parts[1], {}):
+                    return 400, {'error': 'Note is already tagged'}
+                self.tag_note(parts[1], body['id'])
+                return 200, {}
+            return 200, self._note_page(self.tag_notes.get(parts[1], {}), query)
+
+        if parts[0] == 'notes':
+            if len(parts) == 1:
+                return 200, self._note_page(self.notes, query)
+            note = self.notes.get(parts[1])
+            if note is None:
+                return 404, {'error': 'Not found'}
+            if len(parts) == 3 and parts[2] == 'tags':
+                tags = [self.tags[t] for t, n in self.tag_notes.items() if parts[1] in n]
+                return 200, _page(tags, query)
+            if method == 'PUT':
+                new_parent = body.get('parent_id')
+                if new_parent and new_parent != note['parent_id']:
+                    self.folder_notes.get(note['parent_id'], {}).pop(note['id'], None)
+                    self.folder_notes.setdefault(new_parent, {})[note['id']] = None
+                note.update(body)
+                self._event(note['id'], 2)
+            return 200, self._fields(note, query)
+
+        return 404, {'error': 'not found'}
+
+
+class FakeJoplinServer(FakeService):
+    """Joplin Server（/api/sessions、/api/shares）。"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0):
+        super().__init__('joplin_server', latency, error_rate, throttle_rate)
+        self.shares: Dict[str, Dict] = {}
+
+    def add_share(self, note_id: str) -> str:
+        share_id = new_id()
+        self.shares[share_id] = {'id': share_id, 'note_id': note_id, 'type': 1}
+        return share_id
+
+    def route(self, method, path, query, body):
+        if path == '/api/sessions' and method == 'POST':
+            return 200, {'id': new_id(), 'user_id': new_id()}
+        if path == '/api/shares':
+            if method == 'POST':
+                share_id = self.add_share(body['note_id'])
+                return 200, self.shares[share_id]
+            return 200, {'items': list(self.shares.values()), 'has_more': False}
+        if path.startswith('/api/shares/') and method == 'DELETE':
+            self.shares.pop(path.rsplit('/', 1)[1], None)
+            return 200, {}
+        return 404, {'error': 'not found'}
+
+
+class FakeReadeck(FakeService):
+    """
+    Readeck（GET / POST /api/bookmarks、DELETE /api/bookmarks/{id}）。
+
+    新書籤的 state 為 2（擷取中），extract_delay 秒後變成 0（完成），
+    或依 extract_error_rate 的機率變成 1（擷取失敗）。
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 extract_delay: float = 0.0, extract_error_rate: float = 0.0):
+        super().__init__('readeck', latency, error_rate, throttle_rate)
+        self.extract_delay = extract_delay
+        self.extract_error_rate = extract_error_rate
+        self.bookmarks = []
+
+    def _state(self, bookmark):
+        if bookmark['state'] == 2 and time.time() >= bookmark['ready_at']:
+            bookmark['state'] = 1 if random.random() < self.extract_error_rate else 0
+        return bookmark
+
+    def route(self, method, path, query, body):
+        if path.startswith('/api/bookmarks/') and method == 'DELETE':
+            bookmark_id = path.rsplit('/', 1)[1]
+            self.bookmarks = [b for b in self.bookmarks if b['id'] != bookmark_id]
+            return 204, {}
+        if path != '/api/bookmarks':
+            return 404, {'error': 'not found'}
+        if method == 'POST':
+            bookmark_id = new_id()
+            self.bookmarks.append({'id': bookmark_id, 'url': body['url'], 'title': body.get('title'),
+                                   'labels': body.get('labels', []), 'state': 2,
+                                   'ready_at': time.time() + self.extract_delay})
+            return 202, {'status': 202, 'message': 'Link submited'}, {'Bookmark-Id': bookmark_id}
+        items = [self._state(b) for b in self.bookmarks]
+        if query.get('id'):
+            ids = query['id'] if isinstance(query['id'], list) else [query['id']]
+            items = [b for b in items if b['id'] in ids]
+        if query.get('site'):
+            items = [b for b in items if urlparse(b['url']).hostname == query['site']]
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 50))
+        return 200, items[offset:offset + limit]
+
+
+class FakeInstapaper(FakeService):
+    """Instapaper Simple API（POST /api/add）。"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0):
+        super().__init__('instapaper', latency, error_rate, throttle_rate)
+        self.urls = []
+
+    def route(self, method, path, query, body):
+        if path == '/api/add' and method == 'POST':
+            self.urls.append(body.get('url'))
+            return 201, {}
+        return 404, {'error': 'not found'}
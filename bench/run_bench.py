@@ -0,0 +1,174 @@
+"""
+note2read.py 的離線效能測試。
+
+啟動 fake_servers.py 的替身服務，塞入指定數量的 INBOX 筆記，以子行程執行完整的
+note2read.py，回報執行時間、各 endpoint 請求數與子行程的峰值記憶體。
+
+    python bench/run_bench.py --notes 1000 10000 --latency joplin=0.005 --latency readeck=0.02
+    python bench/run_bench.py --notes 1000 --error-rate instapaper=0.05 --json bench.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from fake_servers import FakeInstapaper, FakeJoplinDataAPI, FakeJoplinServer, FakeReadeck
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NOTE2READ = os.path.join(ROOT, "note2read.py")
+SERVICES = ('joplin', 'joplin_server', 'readeck', 'instapaper')
+
+
+def parse_pairs(values, name):
+    result = {}
+    for value in values or []:
+        key, _, number = value.partition('=')
+        if key not in SERVICES or not number:
+            raise SystemExit(f"--{name} 格式為 SERVICE=NUMBER，SERVICE 為 {', '.join(SERVICES)}")
+        result[key] = float(number)
+    return result
+
+
+def seed(joplin: FakeJoplinDataAPI, server: FakeJoplinServer, notes: int, shares: int):
+    """建立 INBOX 筆記，以及掛在舊月份 tag 下、帶 share 的已發佈筆記。"""
+    inbox_id = joplin.add_folder('inbox')
+    archive_id = joplin.add_folder('archive')
+    old_tag_id = joplin.add_tag((datetime.now() - timedelta(days=100)).strftime("%Y%m"))
+
+    now = int(time.time() * 1000)
+    for i in range(shares):
+        note_id = joplin.add_note(f"archived {i}", archive_id, now - 200 * 86400 * 1000 + i)
+        joplin.tag_note(old_tag_id, note_id)
+        server.add_share(note_id)
+    for i in range(notes):
+        joplin.add_note(f"note {i}", inbox_id, now - notes + i)
+    return inbox_id
+
+
+def run_scenario(notes, latency, error_rate, shares=None, sync_mode='full', extra_env=None, timeout=None,
+                 verbose=False, throttle_rate=None, extract_delay=0.0, extract_error_rate=0.0):
+    """
+    執行一次完整的 note2read.py 並回傳統計。
+
+    Returns:
+        Dict: notes, seconds, peak_rss_mb, requests（各服務各 endpoint）, published, left_in_inbox, in_fail
+    """
+    throttle_rate = throttle_rate or {}
+
+    def options(name):
+        return latency.get(name, 0), error_rate.get(name, 0), throttle_rate.get(name, 0)
+
+    joplin = FakeJoplinDataAPI(*options('joplin')).start()
+    server = FakeJoplinServer(*options('joplin_server')).start()
+    readeck = FakeReadeck(*options('readeck'), extract_delay, extract_error_rate).start()
+    instapaper = FakeInstapaper(*options('instapaper')).start()
+    services = (joplin, server, readeck, instapaper)
+
+    try:
+        inbox_id = seed(joplin, server, notes, notes // 10 if shares is None else shares)
+
+        with tempfile.TemporaryDirectory() as state_dir:
+            env = dict(os.environ)
+            env.update({
+                'JOPLIN_DATA_API_URL': joplin.url,
+                'JOPLIN_DATA_API_TOKEN': 'bench',
+                'JOPLIN_SERVER_URL': server.url,
+                'JOPLIN_USERNAME': 'bench@example.com',
+                'JOPLIN_PASSWORD': 'bench',
+                'READECK_URL': readeck.url,
+                'READECK_TOKEN': 'bench',
+                'INSTAPAPER_URL': instapaper.url,
+                'INSTAPAPER_USERNAME': 'bench',
+                'INSTAPAPER_PASSWORD': 'bench',
+                'NOTES_URL': 'https://notes.example.com',
+                'NOTES_URL_PREFIX': '/bench',
+                'INBOX': 'inbox',
+                'SYNC_MODE': sync_mode,
+                'STATE_DIR': state_dir,
+            })
+            env.update(extra_env or {})
+
+            output = None if verbose else subprocess.DEVNULL
+            start = time.time()
+            proc = subprocess.Popen([sys.executable, NOTE2READ], env=env, cwd=ROOT,
+                                    stdout=output, stderr=output)
+            timer = None
+            if timeout:
+                timer = threading.Timer(timeout, proc.kill)
+                timer.start()
+            _, status, usage = os.wait4(proc.pid, 0)
+            seconds = time.time() - start
+            if timer:
+                timer.cancel()
+            proc.returncode = os.waitstatus_to_exitcode(status)
+
+        # Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes
+        peak = usage.ru_maxrss / 1024 if sys.platform != 'darwin' else usage.ru_maxrss / (1024 * 1024)
+        return {
+            'notes': notes,
+            'exit_code': proc.returncode,
+            'seconds': round(seconds, 3),
+            'notes_per_second': round(notes / seconds, 2) if seconds else 0.0,
+            'peak_rss_mb': round(peak, 1),
+            'requests': {s.name: dict(sorted(s.calls.items())) for s in services},
+            'total_requests': sum(sum(s.calls.values()) for s in services),
+            'published': {'readeck': len(readeck.bookmarks), 'instapaper': len(instapaper.urls)},
+            'left_in_inbox': joplin.notes_in(inbox_id),
+            'in_fail': sum(joplin.notes_in(f['id']) for f in joplin.folders.values() if f['title'] == 'fail'),
+        }
+    finally:
+        for service in services:
+            service.stop()
+
+
+def print_result(result):
+    print(f"notes {result['notes']}: {result['seconds']}s ({result['notes_per_second']} notes/s), "
+          f"peak rss {result['peak_rss_mb']} MB, {result['total_requests']} requests, "
+          f"exit {result['exit_code']}")
+    print(f"  published readeck {result['published']['readeck']}, instapaper {result['published']['instapaper']}, "
+          f"left in inbox {result['left_in_inbox']}, in fail {result['in_fail']}")
+    for name, calls in result['requests'].items():
+        for endpoint, count in calls.items():
+            print(f"  {name:<14}{endpoint:<32}{count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark note2read.py against local stand-in servers")
+    parser.add_argument('--notes', type=int, nargs='+', default=[1000], help="INBOX 筆記數，可給多個")
+    parser.add_argument('--shares', type=int, default=None, help="舊月份 share 數（預設為筆記數的 1/10）")
+    parser.add_argument('--latency', action='append', metavar='SERVICE=SECONDS', help="每個請求的延遲")
+    parser.add_argument('--error-rate', action='append', metavar='SERVICE=RATE', help="回傳 503 的機率")
+    parser.add_argument('--throttle-rate', action='append', metavar='SERVICE=RATE', help="回傳 429 的機率")
+    parser.add_argument('--extract-delay', type=float, default=0.0, help="Readeck 擷取頁面所需秒數")
+    parser.add_argument('--extract-error-rate', type=float, default=0.0, help="Readeck 擷取失敗的機率")
+    parser.add_argument('--sync-mode', default='full', choices=('full', 'incremental'))
+    parser.add_argument('--env', action='append', metavar='KEY=VALUE', help="額外傳給 note2read.py 的環境變數")
+    parser.add_argument('--timeout', type=float, default=None, help="單次執行的逾時秒數")
+    parser.add_argument('--json', metavar='PATH', help="把結果寫成 JSON")
+    parser.add_argument('-v', '--verbose', action='store_true', help="顯示 note2read.py 的輸出")
+    args = parser.parse_args()
+
+    latency = parse_pairs(args.latency, 'latency')
+    error_rate = parse_pairs(args.error_rate, 'error-rate')
+    throttle_rate = parse_pairs(args.throttle_rate, 'throttle-rate')
+    extra_env = dict(value.split('=', 1) for value in args.env or [])
+
+    results = []
+    for notes in args.notes:
+        result = run_scenario(notes, latency, error_rate, args.shares, args.sync_mode, extra_env,
+                              args.timeout, args.verbose, throttle_rate, args.extract_delay, args.extract_error_rate)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
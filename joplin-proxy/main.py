@@ -1,6 +1,10 @@
 import os
 import re
-from typing import Optional, Set
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set, Tuple
 from fastapi import FastAPI, HTTPException, Request
 import requests
 from markdown_it import MarkdownIt
@@ -25,6 +29,18 @@ NOTES_URL_PREFIX = os.getenv("NOTES_URL_PREFIX", "")
 SERVER_URL = os.getenv("JOPLIN_SERVER_URL")
 USER = os.getenv("JOPLIN_USERNAME")
 PASS = os.getenv("JOPLIN_PASSWORD")
+# A share is reused for all resources of its note for SHARE_TTL seconds. Expired shares are
+# kept SHARE_GRACE more seconds for in-flight downloads, then deleted by the sweeper.
+SHARE_TTL = float(os.getenv("SHARE_TTL", "600"))
+SHARE_GRACE = float(os.getenv("SHARE_GRACE", "60"))
+SHARE_SWEEP_INTERVAL = float(os.getenv("SHARE_SWEEP_INTERVAL", "60"))
+# The Joplin Server session is reused for SESSION_TTL seconds; a failed login is not retried
+# for LOGIN_RETRY_DELAY seconds so a burst of requests does not turn into a burst of logins.
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+LOGIN_RETRY_DELAY = float(os.getenv("LOGIN_RETRY_DELAY", "5"))
+# resource_id -> note_id lookups kept in memory (LRU, at most RESOURCE_NOTE_CACHE_SIZE entries)
+RESOURCE_NOTE_CACHE_SIZE = int(os.getenv("RESOURCE_NOTE_CACHE_SIZE", "4096"))
+RESOURCE_NOTE_TTL = float(os.getenv("RESOURCE_NOTE_TTL", "3600"))
 
 # Bleach configuration: allow a reasonably safe subset of tags/attributes
 ALLOWED_TAGS = list(bleach.sanitizer.ALLOWED_TAGS) + [
@@ -57,7 +73,16 @@ ALLOWED_ATTRIBUTES = {
 }
 ALLOWED_PROTOCOLS = list(bleach.sanitizer.ALLOWED_PROTOCOLS) + ["data", "http", "https"]
 
-app = FastAPI(root_path=NOTES_URL_PREFIX)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    shares.start()
+    yield
+    # delete the shares this process created
+    shares.close()
+
+
+app = FastAPI(root_path=NOTES_URL_PREFIX, lifespan=lifespan)
 
 def remove_p_around_img(html: str) -> str:
     # 移除 <p> 僅包住一個 <img> 的情況（允許 img 前後有空白）
@@ -81,13 +106,86 @@ def get_session(user, passwd):
         'password': passwd,
     }
 
-    res = requests.post(url, json=data, headers=headers)
+    res = requests.post(url, json=data, headers=headers, timeout=10)
 
     if res.status_code != 200:
         return None
     return res.json()['id']
 
 
+class SessionManager:
+    """
+    Process-wide Joplin Server session shared by all requests and threads.
+
+    Logs in on first use and renews the token lazily: on the first request after `ttl`
+    seconds, or after the server rejected it (see `invalidate`). Logins are single-flight:
+    requests that need a token while a login is in progress wait for its result instead of
+    sending their own.
+    """
+
+    def __init__(self, user: Optional[str], password: Optional[str], ttl: float = SESSION_TTL,
+                 retry_delay: float = LOGIN_RETRY_DELAY):
+        self.user = user
+        self.password = password
+        self.ttl = ttl
+        self.retry_delay = retry_delay
+        self.lock = threading.Lock()
+        self.token: Optional[str] = None
+        self.created = 0.0
+        self.failed = float("-inf")
+
+    def get(self) -> Optional[str]:
+        with self.lock:
+            now = time.monotonic()
+            if self.token and now - self.created < self.ttl:
+                return self.token
+            if now - self.failed < self.retry_delay:
+                return None
+            try:
+                token = get_session(self.user, self.password)
+            except (requests.RequestException, ValueError) as e:
+                logging.warning(f"Joplin Server login failed: {e}")
+                token = None
+            if token:
+                self.token, self.created = token, time.monotonic()
+            else:
+                self.token, self.failed = None, time.monotonic()
+            return token
+
+    def invalidate(self, token: str):
+        """Drop a token the server rejected; only the first of many concurrent 401s forces a new login."""
+        with self.lock:
+            if self.token == token:
+                self.token = None
+
+
+sessions = SessionManager(USER, PASS)
+
+
+def server_request(method: str, path: str, **kwargs) -> Optional[requests.Response]:
+    """
+    Call the Joplin Server API with the shared session, logging in again once on 401/403.
+
+    Returns None when no session can be obtained.
+    """
+    kwargs.setdefault("timeout", 10)
+    res = None
+    for _ in range(2):
+        token = sessions.get()
+        if not token:
+            return None
+        headers = {
+            'Content-Type': 'application/json; charset=UTF-8',
+            'X-Accept': 'application/json',
+            'X-Api-Auth': token
+        }
+        res = requests.request(method, f"{SERVER_URL}{path}", headers=headers, **kwargs)
+        if res.status_code not in (401, 403):
+            return res
+        sessions.invalidate(token)
+    return res
+
+
 def client_ip_from_request(request: Request) -> Optional[str]:
     # Honor X-Forwarded-For if present (common behind ingress)
     xff = request.headers.get("x-forwarded-for")
@@ -107,44 +205,222 @@ def healthz():
 
 
 import json
-def get_share_id(token, note_id):
-    url = f"{SERVER_URL}/api/shares"
-    headers = {
-        'Content-Type': 'application/json; charset=UTF-8',
-        'X-Accept': 'application/json',
-        'X-Api-Auth': token
-    }
+def get_share_id(note_id):
     data = {
         'note_id': note_id,
         'recursive': 0
     }
 
-    res = requests.post(url, json=data, headers=headers)
+    res = server_request("POST", "/api/shares", json=data)
+
+    if res is None or res.status_code != 200:
+        logging.warning(f"create share for note {note_id} failed: {res.status_code if res is not None else 'no session'}")
+        return ''
     data_bytes = res.content
     data_str = data_bytes.decode('utf-8')
     data = json.loads(data_str)
+    return data['id']
 
-    if res.status_code != 200:
-        return ''
-    else:
-        return data['id']
-    
 
-def del_share_id(token, item_id):
-    url = f"{SERVER_URL}/api/shares/{item_id}"
-    headers = {
-        'Content-Type': 'application/json; charset=UTF-8',
-        'X-Accept': 'application/json',
-        'X-Api-Auth': token
-    }
+def find_share_id(note_id) -> Optional[str]:
+    """
+    Return the id of a share that already exists for the note, '' if there is none,
+    or None if the share list could not be read.
+    """
+    res = server_request("GET", "/api/shares")
 
-    res = requests.delete(url, headers=headers)
+    if res is None or res.status_code != 200:
+        logging.warning(f"list shares failed: {res.status_code if res is not None else 'no session'}")
+        return None
+    for item in res.json().get('items', []):
+        if item.get('note_id') == note_id:
+            return item['id']
+    return ''
 
-    if res.status_code != 200:
+
+def del_share_id(item_id):
+    res = server_request("DELETE", f"/api/shares/{item_id}")
+
+    if res is None or res.status_code != 200:
         return False
     else:
         return True
-    
+
+
+class ShareManager:
+    """
+    One Joplin Server share per note, reused by every resource of that note.
+
+    A cached share is handed out for `ttl` seconds after it was created. After that it is
+    retired: kept `grace` more seconds so downloads that already have its id can finish, and
+    then deleted by the background sweeper. Only one share is created per note at a time,
+    even when a page requests many of its images at once. Shares still held at shutdown are
+    deleted too, so the share table does not grow with every resource request.
+
+    Only shares this process created are deleted. A note that was already shared (Joplin Server
+    returns the existing share for it) keeps its share; the id is cached and simply forgotten
+    after `ttl`. When the share list cannot be read the new share is treated as pre-existing.
+    A share of ours that is found again after its `ttl` (the server still lists it during the
+    grace period) stays ours: it is taken back from the retired list instead of being adopted
+    as pre-existing and deleted under the cache.
+    """
+
+    def __init__(self, ttl: float = SHARE_TTL, grace: float = SHARE_GRACE,
+                 sweep_interval: float = SHARE_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.grace = grace
+        self.sweep_interval = sweep_interval
+        self.lock = threading.Lock()
+        self.shares: Dict[str, Tuple[str, float, bool]] = {}  # note_id -> (share_id, created_at, owned)
+        self.retired: List[Tuple[str, float]] = []      # (share_id, retired_at)
+        self.note_locks: Dict[str, threading.Lock] = {}
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def _fresh(self, note_id: str, now: float) -> Optional[str]:
+        entry = self.shares.get(note_id)
+        if entry and now - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def _retire(self, note_id: str, now: float):
+        entry = self.shares.pop(note_id, None)
+        if entry and entry[2]:
+            self.retired.append((entry[0], now))
+
+    def get(self, note_id: str) -> str:
+        """Return a share id for the note, creating a share only if there is no fresh one."""
+        with self.lock:
+            share_id = self._fresh(note_id, time.monotonic())
+            if share_id:
+                return share_id
+            note_lock = self.note_locks.setdefault(note_id, threading.Lock())
+
+        with note_lock:
+            # another request may have created it while we were waiting
+            with self.lock:
+                share_id = self._fresh(note_id, time.monotonic())
+                if share_id:
+                    return share_id
+
+            existing = find_share_id(note_id)
+            share_id = existing or get_share_id(note_id)
+            if share_id:
+                with self.lock:
+                    now = time.monotonic()
+                    entry = self.shares.get(note_id)
+                    retired = [item for item in self.retired if item[0] == share_id]
+                    if (entry and entry[0] == share_id and entry[2]) or retired:
+                        # our own expiring share: refresh it rather than retire and re-adopt it
+                        self.retired = [item for item in self.retired if item[0] != share_id]
+                        self.shares[note_id] = (share_id, now, True)
+                    else:
+                        self._retire(note_id, now)
+                        self.shares[note_id] = (share_id, now, existing == '')
+            return share_id
+
+    def invalidate(self, note_id: str, share_id: str):
+        """Forget a share that no longer exists on the server (e.g. removed by note2read's cleanup)."""
+        with self.lock:
+            entry = self.shares.get(note_id)
+            if entry and entry[0] == share_id:
+                del self.shares[note_id]
+
+    def sweep(self, force: bool = False) -> int:
+        """Retire expired shares and delete retired ones past their grace period; returns how many were deleted."""
+        now = time.monotonic()
+        with self.lock:
+            for note_id, (_, created, _) in list(self.shares.items()):
+                if force or now - created >= self.ttl:
+                    self._retire(note_id, now)
+            due = [share_id for share_id, retired in self.retired if force or now - retired >= self.grace]
+            self.retired = [(share_id, retired) for share_id, retired in self.retired
+                            if not (force or now - retired >= self.grace)]
+            for note_id, note_lock in list(self.note_locks.items()):
+                if note_id not in self.shares and not note_lock.locked():
+                    del self.note_locks[note_id]
+
+        if not due:
+            return 0
+        deleted = 0
+        for share_id in due:
+            if del_share_id(share_id):
+                deleted += 1
+                with self.lock:
+                    # a get() that raced with this sweep may have cached the share again
+                    for note_id, entry in list(self.shares.items()):
+                        if entry[0] == share_id:
+                            del self.shares[note_id]
+            else:
+                # already gone or server unavailable; note2read's cleanup removes leftovers
+                logging.warning(f"delete share {share_id} failed")
+        logging.info(f"share sweeper: deleted {deleted} of {len(due)} shares")
+        return deleted
+
+    def _run(self):
+        while not self.stopped.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.warning(f"share sweeper failed: {e}")
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="share-sweeper", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        try:
+            self.sweep(force=True)
+        except Exception as e:
+            logging.warning(f"share cleanup at shutdown failed: {e}")
+
+
+shares = ShareManager()
+
+
+class ResourceNoteCache:
+    """
+    Bounded LRU of resource_id -> note_id with a TTL.
+
+    get_note fills it with every resource it rewrites, so the image requests that follow a
+    page render do not have to ask the Data API which note owns each resource.
+    """
+
+    def __init__(self, maxsize: int = RESOURCE_NOTE_CACHE_SIZE, ttl: float = RESOURCE_NOTE_TTL):
+        self.maxsize = max(maxsize, 1)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.items: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, resource_id: str) -> Optional[str]:
+        with self.lock:
+            entry = self.items.get(resource_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] >= self.ttl:
+                del self.items[resource_id]
+                return None
+            self.items.move_to_end(resource_id)
+            return entry[0]
+
+    def put(self, resource_id: str, note_id: str):
+        with self.lock:
+            self.items[resource_id] = (note_id, time.monotonic())
+            self.items.move_to_end(resource_id)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def discard(self, resource_id: str):
+        with self.lock:
+            self.items.pop(resource_id, None)
+
+
+resource_notes = ResourceNoteCache()
+
 
 import os
 import io
@@ -190,29 +466,48 @@ def get_resource(resource_id: str):
     if os.path.exists(cache_path):
         return StreamingResponse(open(cache_path, "rb"), media_type="image/jpeg")
 
-    endpoint = f"{API_URL.rstrip('/')}/resources/{resource_id}/notes"
-    try:
-        r = requests.get(endpoint, timeout=10, params={"token": API_TOKEN})
-    except requests.RequestException:
-        raise HTTPException(status_code=502, detail="Bad Gateway: failed to contact Joplin API")
-    if r.status_code != 200:
-        raise HTTPException(status_code=404, detail="Note not found")
-
-    note_id = ""
-    if len(r.json()['items']) != 0:
-        note_id = r.json()['items'][0]['id']
-    else:
-        logging.warning(f"resource: {resource_id} parent note_id items = 0, {r.json()}")
-
-    token = get_session(USER, PASS)
-    share_id = get_share_id(token, note_id)
-    endpoint = f"{SERVER_URL.rstrip('/')}/shares/{share_id}?resource_id={resource_id}"
-
-    try:
-        r = requests.get(endpoint, stream=True, timeout=15)
-    except requests.RequestException:
-        raise HTTPException(status_code=502, detail="Bad Gateway: failed to contact Joplin API for resource")
+    note_id = resource_notes.get(resource_id)
+    cached = note_id is not None
+    if not cached:
+        endpoint = f"{API_URL.rstrip('/')}/resources/{resource_id}/notes"
+        try:
+            r = requests.get(endpoint, timeout=10, params={"token": API_TOKEN})
+        except requests.RequestException:
+            raise HTTPException(status_code=502, detail="Bad Gateway: failed to contact Joplin API")
+        if r.status_code != 200:
+            raise HTTPException(status_code=404, detail="Note not found")
+
+        data = r.json()
+        items = data.get('items', [])
+        if not items:
+            logging.warning(f"resource: {resource_id} parent note_id items = 0, {data}")
+            raise HTTPException(status_code=404, detail="Note not found")
+        note_id = items[0]['id']
+        resource_notes.put(resource_id, note_id)
+
+    def fetch(share_id):
+        endpoint = f"{SERVER_URL.rstrip('/')}/shares/{share_id}?resource_id={resource_id}"
+        try:
+            return requests.get(endpoint, stream=True, timeout=15)
+        except requests.RequestException:
+            raise HTTPException(status_code=502, detail="Bad Gateway: failed to contact Joplin API for resource")
+
+    share_id = shares.get(note_id)
+    if not share_id:
+        if cached:
+            resource_notes.discard(resource_id)
+        raise HTTPException(status_code=502, detail="Bad Gateway: failed to create share")
+    r = fetch(share_id)
+    if r.status_code == 404:
+        # the cached share was deleted on the server; create a new one once
+        shares.invalidate(note_id, share_id)
+        share_id = shares.get(note_id)
+        if share_id:
+            r = fetch(share_id)
     if r.status_code != 200:
+        if cached:
+            # the resource may have moved to another note; look it up again next time
+            resource_notes.discard(resource_id)
         raise HTTPException(status_code=404, detail=f"Resource not found status_code: {r.status_code}")
 
     content = r.content
@@ -230,7 +525,7 @@ def get_resource(resource_id: str):
         return StreamingResponse(io.BytesIO(content), media_type=content_type)
 
 
-def _replace_joplin_resource_links(body: str, request: Request) -> str:
+def _replace_joplin_resource_links(body: str, request: Request, note_id: Optional[str] = None) -> str:
     """
     Replace Joplin resource references in Markdown / HTML with proxied URLs to /v1/r/{resource_id}.
 
@@ -240,9 +535,13 @@ def _replace_joplin_resource_links(body: str, request: Request) -> str:
       - Plain :/resourceid inside parentheses (:/resourceid)
 
     Uses request.url_for to build URLs that respect app root_path and uses the v1 resource endpoint name.
+    When note_id is given, each rewritten resource id is recorded in resource_notes.
     """
     # Use the v1 resource route name to ensure versioned URL is used
-    url_builder = lambda resource_id: request.url_for("get_resource_v1", resource_id=resource_id)
+    def url_builder(resource_id):
+        if note_id:
+            resource_notes.put(resource_id, note_id)
+        return request.url_for("get_resource_v1", resource_id=resource_id)
 
     # pattern for markdown image: ![alt](:/resourceid)
     md_img_pattern = re.compile(r'!\[([^\]]*)\]\(:/([0-9a-fA-F\-]+)\)')
@@ -293,7 +592,7 @@ def get_note(note_id: str, request: Request):
     body = note.get("body", "") or ""
 
     # Replace Joplin resource tokens (:/<id>) with proxied resource URLs (v1)
-    body = _replace_joplin_resource_links(body, request)
+    body = _replace_joplin_resource_links(body, request, note.get("id") or note_id)
 
     # Convert from Markdown to HTML using markdown-it-py and allow inline HTML
     md = MarkdownIt("commonmark", {"html": True, "linkify": True, "typographer": True, "breaks": True})
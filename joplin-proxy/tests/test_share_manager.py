@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+class FakeShareServer:
+    """Joplin Server shares: POST returns the note's existing share, like the real server."""
+
+    def __init__(self):
+        self.shares = {}  # share_id -> note_id
+        self.count = 0
+        self.list_fails = False
+
+    def find(self, note_id):
+        if self.list_fails:
+            return None
+        for share_id, shared_note in self.shares.items():
+            if shared_note == note_id:
+                return share_id
+        return ''
+
+    def create(self, note_id):
+        for share_id, shared_note in self.shares.items():
+            if shared_note == note_id:
+                return share_id
+        self.count += 1
+        share_id = f"share{self.count}"
+        self.shares[share_id] = note_id
+        return share_id
+
+    def delete(self, share_id):
+        return self.shares.pop(share_id, None) is not None
+
+
+class ShareManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeShareServer()
+        patched = {'find_share_id': self.server.find, 'get_share_id': self.server.create,
+                   'del_share_id': self.server.delete}
+        for name, func in patched.items():
+            original = getattr(main, name)
+            setattr(main, name, func)
+            self.addCleanup(setattr, main, name, original)
+
+    def test_existing_share_is_not_deleted(self):
+        self.server.shares['user-share'] = 'pub'
+        manager = main.ShareManager(ttl=0.05, grace=0)
+        self.assertEqual(manager.get('pub'), 'user-share')
+        manager.close()
+        self.assertIn('user-share', self.server.shares)
+
+    def test_expired_share_is_kept_after_get(self):
+        manager = main.ShareManager(ttl=0.05, grace=10)
+        share_id = manager.get('n1')
+        time.sleep(0.1)
+        manager.sweep()  # expire: retired, still live during the grace period
+        self.assertEqual(manager.get('n1'), share_id)
+        manager.grace = 0
+        manager.sweep()
+        # the cached share was refreshed, not deleted under the cache
+        self.assertIn(share_id, self.server.shares)
+        self.assertEqual(manager.get('n1'), share_id)
+        self.assertEqual(self.server.count, 1)
+        manager.close()
+        self.assertEqual(self.server.shares, {})
+
+    def test_expired_share_found_while_listing_fails_is_still_ours(self):
+        manager = main.ShareManager(ttl=0.05, grace=10)
+        share_id = manager.get('n1')
+        time.sleep(0.1)
+        self.server.list_fails = True
+        self.assertEqual(manager.get('n1'), share_id)
+        manager.close()
+        self.assertEqual(self.server.shares, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+# 每篇筆記送到 Readeck 的 label 數上限（含週 label）
+READECK_MAX_LABELS = int(os.getenv("READECK_MAX_LABELS", "8"))
+READECK_MAX_LABEL_LENGTH = int(os.getenv("READECK_MAX_LABEL_LENGTH", "64"))
+
+# note2read 自己套用的 yearmonth tag（YYYYMM）只用於清除 share，不轉成 label
+_YEARMONTH = re.compile(r'^\d{6}$')
+
+
+def is_yearmonth_tag(name: str) -> bool:
+    return bool(_YEARMONTH.match(name))
+
+
+def compute_labels(tags: Iterable[str], week: str, max_labels: int = READECK_MAX_LABELS,
+                   max_length: int = READECK_MAX_LABEL_LENGTH) -> List[str]:
+    """
+    由筆記的 Joplin tag 與週 label 算出 Readeck labels。
+
+    tag 去除前後空白、略過 yearmonth tag 與重複值後排序，最多取 max_labels - 1 個，
+    最後一個固定是週 label；相同輸入一定得到相同結果。
+
+    Args:
+        tags (Iterable[str]): 筆記的 Joplin tag 名稱
+        week (str): 週 label（format_ym_week() 的結果）
+        max_labels (int): label 數上限（含週 label）
+        max_length (int): 單一 label 的長度上限
+
+    Returns:
+        List[str]: 最多 max_labels 個 label
+    """
+    names = set()
+    for tag in tags:
+        name = (tag or '').strip()[:max_length]
+        if name and name != week and not is_yearmonth_tag(name):
+            names.add(name)
+    return sorted(names)[:max(max_labels - 1, 0)] + [week]
+
+
+class LabelEngine:
+    """
+    一次執行內共用的 note ID → Readeck labels 計算。
+
+    提供 load_note_tags 時，前幾篇筆記逐篇查詢 tag（結果快取）；逐篇查詢的次數達到 tag 數
+    （批次讀取所需的請求數）後改為呼叫 load_tags() 一次取得所有筆記的 tag（{note_id: [tag 名稱]}），
+    之後都在記憶體中計算。INBOX 只有幾篇筆記時不會掃描所有 tag，backfill 等大批次的總請求數
+    最多是直接批次讀取的兩倍。週 label 在建立時固定，整次執行所有筆記一致。
+
+    Args:
+        load_tags (Callable[[], Dict[str, List[str]]]): 批次取得 note ID → tag 名稱
+        week (str): 週 label
+        max_labels (int): 每篇筆記的 label 數上限（含週 label）
+        load_note_tags (Callable[[str], List[str]], optional): 取得單一筆記的 tag 名稱；未提供時一律批次讀取
+        tag_count (Callable[[], int], optional): 批次讀取需要掃描的 tag 數
+    """
+
+    def __init__(self, load_tags: Callable[[], Dict[str, List[str]]], week: str,
+                 max_labels: int = READECK_MAX_LABELS,
+                 load_note_tags: Optional[Callable[[str], List[str]]] = None,
+                 tag_count: Optional[Callable[[], int]] = None):
+        self.load_tags = load_tags
+        self.week = week
+        self.max_labels = max_labels
+        self.load_note_tags = load_note_tags
+        self.tag_count = tag_count
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self._threshold: Optional[int] = None
+        self._tags: Optional[Dict[str, List[str]]] = None
+        self._note_tags: Dict[str, List[str]] = {}
+
+    def tags(self, note_id: str) -> List[str]:
+        with self.lock:
+            if self._tags is None and note_id in self._note_tags:
+                return self._note_tags[note_id]
+            if self._tags is None and self.load_note_tags:
+                if self._threshold is None:
+                    self._threshold = self.tag_count() if self.tag_count else 0
+                single = self.lookups < self._threshold
+                if single:
+                    self.lookups += 1
+            else:
+                single = False
+            if not single:
+                if self._tags is None:
+                    self._tags = self.load_tags()
+                return self._tags.get(note_id, [])
+
+        # 逐篇查詢不持有 lock，多個 worker 可同時查詢
+        tags = self.load_note_tags(note_id)
+        with self.lock:
+            self._note_tags[note_id] = tags
+        return tags
+
+    def labels(self, note_id: str) -> List[str]:
+        return compute_labels(self.tags(note_id), self.week, self.max_labels)
@@ -0,0 +1,212 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+# 每次執行結束時把統計寫到這個目錄（預設與 STATE_DIR 相同，CronJob 掛在 /logs）
+METRICS_DIR = os.getenv("METRICS_DIR", os.getenv("STATE_DIR", "/logs"))
+METRICS_JSON = "note2read-metrics.json"
+METRICS_PROM = "note2read.prom"
+
+# 路徑中的 note / tag / share ID 合併成 {id}，避免每個 ID 各成一個 endpoint
+_ID_SEGMENT = re.compile(r'/[0-9A-Za-z_-]{16,}(?=/|$)')
+
+
+def endpoint_name(method: str, url: str) -> str:
+    """把 URL 轉成 'GET /notes/{id}' 形式的 endpoint 名稱。"""
+    return f"{method.upper()} {_ID_SEGMENT.sub('/{id}', urlparse(url).path)}"
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """nearest-rank 百分位數，samples 需已排序。"""
+    if not samples:
+        return 0.0
+    rank = max(math.ceil(q * len(samples)) - 1, 0)
+    return samples[min(rank, len(samples) - 1)]
+
+
+class RunMetrics:
+    """
+    單次執行的統計：各階段耗時、各上游 endpoint 的請求數與延遲、處理的筆記數。
+
+    階段可能在多個 thread 中同時進行，因此同時記錄 busy（各次耗時加總）與
+    wall（第一次開始到最後一次結束）。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.requests: Dict[tuple, List[float]] = {}
+        self.errors: Dict[tuple, int] = {}
+        self.counters: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            with self.lock:
+                s = self.stages.setdefault(name, {'busy': 0.0, 'count': 0, 'start': start, 'end': end})
+                s['busy'] += end - start
+                s['count'] += 1
+                s['start'] = min(s['start'], start)
+                s['end'] = max(s['end'], end)
+
+    def observe_request(self, upstream: str, method: str, url: str, status: Optional[int], seconds: float):
+        key = (upstream, endpoint_name(method, url))
+        with self.lock:
+            self.requests.setdefault(key, []).append(seconds)
+            if status is None or status >= 500:
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def finish(self):
+        self.finished = time.time()
+
+    def summary(self) -> Dict:
+        with self.lock:
+            run_seconds = (self.finished or time.time()) - self.started
+            notes = self.counters.get('notes', 0)
+            stages = {
+                name: {
+                    'wall_seconds': round(s['end'] - s['start'], 4),
+                    'busy_seconds': round(s['busy'], 4),
+                    'count': s['count'],
+                }
+                for name, s in self.stages.items()
+            }
+            endpoints = []
+            for (upstream, endpoint), samples in sorted(self.requests.items()):
+                ordered = sorted(samples)
+                endpoints.append({
+                    'upstream': upstream,
+                    'endpoint': endpoint,
+                    'requests': len(ordered),
+                    'errors': self.errors.get((upstream, endpoint), 0),
+                    'p50': round(percentile(ordered, 0.50), 4),
+                    'p90': round(percentile(ordered, 0.90), 4),
+                    'p99': round(percentile(ordered, 0.99), 4),
+                    'max': round(ordered[-1], 4),
+                })
+            return {
+                'started': self.started,
+                'run_seconds': round(run_seconds, 4),
+                'notes': notes,
+                'notes_per_second': round(notes / run_seconds, 4) if run_seconds > 0 else 0.0,
+                'counters': dict(self.counters),
+                'stages': stages,
+                'endpoints': endpoints,
+            }
+
+
+def to_prometheus(summary: Dict) -> str:
+    """把 summary 轉成 node exporter textfile collector 的格式。"""
+    lines = [
+        "# HELP note2read_run_seconds Wall time of the last note2read run.",
+        "# TYPE note2read_run_seconds gauge",
+        f"note2read_run_seconds {summary['run_seconds']}",
+        "# HELP note2read_last_run_timestamp_seconds Start time of the last note2read run.",
+        "# TYPE note2read_last_run_timestamp_seconds gauge",
+        f"note2read_last_run_timestamp_seconds {summary['started']:.0f}",
+        "# HELP note2read_notes_processed Notes processed by the last run.",
+        "# TYPE note2read_notes_processed gauge",
+        f"note2read_notes_processed {summary['notes']}",
+        "# HELP note2read_notes_per_second Notes processed per second in the last run.",
+        "# TYPE note2read_notes_per_second gauge",
+        f"note2read_notes_per_second {summary['notes_per_second']}",
+        "# HELP note2read_stage_seconds Wall time per stage of the last run.",
+        "# TYPE note2read_stage_seconds gauge",
+    ]
+    for name, s in summary['stages'].items():
+        lines.append(f'note2read_stage_seconds{{stage="{name}"}} {s["wall_seconds"]}')
+    lines += [
+        "# HELP note2read_stage_busy_seconds Summed time per stage across workers in the last run.",
+        "# TYPE note2read_stage_busy_seconds gauge",
+    ]
+    for name, s in summary['stages'].items():
+        lines.append(f'note2read_stage_busy_seconds{{stage="{name}"}} {s["busy_seconds"]}')
+    lines += [
+        "# HELP note2read_upstream_requests Requests per upstream endpoint in the last run.",
+        "# TYPE note2read_upstream_requests gauge",
+    ]
+    for e in summary['endpoints']:
+        lines.append(f'note2read_upstream_requests{{upstream="{e["upstream"]}",endpoint="{e["endpoint"]}"}} {e["requests"]}')
+    lines += [
+        "# HELP note2read_upstream_errors Failed requests (5xx or no response) per upstream endpoint in the last run.",
+        "# TYPE note2read_upstream_errors gauge",
+    ]
+    for e in summary['endpoints']:
+        lines.append(f'note2read_upstream_errors{{upstream="{e["upstream"]}",endpoint="{e["endpoint"]}"}} {e["errors"]}')
+    lines += [
+        "# HELP note2read_upstream_latency_seconds Request latency per upstream endpoint in the last run.",
+        "# TYPE note2read_upstream_latency_seconds gauge",
+    ]
+    for e in summary['endpoints']:
+        for q in ('p50', 'p90', 'p99'):
+            quantile = f"0.{q[1:]}"
+            lines.append(
+                f'note2read_upstream_latency_seconds{{upstream="{e["upstream"]}",endpoint="{e["endpoint"]}",quantile="{quantile}"}} {e[q]}'
+            )
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, content: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def write_report(summary: Dict, directory: str = METRICS_DIR):
+    """把 JSON summary 與 Prometheus textfile 寫到 directory，失敗時只印出警告。"""
+    try:
+        os.makedirs(directory, exist_ok=True)
+        _write_atomic(os.path.join(directory, METRICS_JSON), json.dumps(summary, indent=2, ensure_ascii=False))
+        _write_atomic(os.path.join(directory, METRICS_PROM), to_prometheus(summary))
+    except OSError as e:
+        print(f"⚠️ 無法寫入 metrics: {e}")
+
+
+def load_report(directory: str = METRICS_DIR) -> Optional[Dict]:
+    """讀取上一次執行寫出的 JSON summary；不存在或無法解析時回傳 None。"""
+    try:
+        with open(os.path.join(directory, METRICS_JSON)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def print_report(summary: Dict):
+    print(f"run {summary['run_seconds']}s, notes {summary['notes']}, {summary['notes_per_second']} notes/s")
+    for name, s in summary['stages'].items():
+        print(f"stage {name}:\twall {s['wall_seconds']}s\tbusy {s['busy_seconds']}s\tcount {s['count']}")
+    for e in summary['endpoints']:
+        print(f"{e['upstream']} {e['endpoint']}:\t{e['requests']} req\tp50 {e['p50']}s\tp90 {e['p90']}s\tp99 {e['p99']}s")
+
+
+_current = RunMetrics()
+_current_lock = threading.Lock()
+
+
+def get_metrics() -> RunMetrics:
+    return _current
+
+
+def start_run() -> RunMetrics:
+    """開始新的一次執行統計。"""
+    global _current
+    with _current_lock:
+        _current = RunMetrics()
+        return _current
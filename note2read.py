@@ -1,15 +1,31 @@
 import os, sys
+import itertools
+import json
+import signal
+import sqlite3
+import threading
+import time
 import requests
 from requests.auth import HTTPBasicAuth
 
 import click
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
+from typing import Iterable, Iterator, List, Dict, Optional, Set, Tuple
+from urllib.parse import urlparse
 
 load_dotenv()
 
+from upstream import (CircuitOpenError, Upstream, get_breaker, get_upstream, print_connection_report,
+                      raise_for_transient, set_rate)
+from state import LEASE_SETTLE, Ledger, PendingBookmarks, RetryQueue, ShardLeases, get_leases, get_store
+from metrics import METRICS_DIR, endpoint_name, get_metrics, load_report, print_report, start_run, write_report
+from labels import LabelEngine, is_yearmonth_tag
+from accounts import Account, account_from_env, load_accounts
+
 API_URL = os.getenv("JOPLIN_DATA_API_URL")
 API_TOKEN = os.getenv("JOPLIN_DATA_API_TOKEN")
 SERVER_URL = os.getenv("JOPLIN_SERVER_URL")
@@ -19,19 +35,100 @@ READECK_URL = os.getenv("READECK_URL")
 READECK_TOKEN = os.getenv("READECK_TOKEN")
 USERNAME = os.getenv("INSTAPAPER_USERNAME")
 PASSWORD = os.getenv("INSTAPAPER_PASSWORD")
+INSTAPAPER_URL = os.getenv("INSTAPAPER_URL", "https://www.instapaper.com")
 NOTES_URL = os.getenv("NOTES_URL")
 NOTES_URL_PREFIX = os.getenv("NOTES_URL_PREFIX")
 INBOX = os.getenv("INBOX")
-
-def add_to_instapaper(url: str, title: str = None, selection: str = None) -> bool:
+# 同時處理的筆記數與各目的地的同時推送數；0 時 worker pool 跟隨上游 AIMD 並行上限的最大值
+# （HTTP_CONCURRENCY_MAX），實際並行數由 limiter 依上游的容量調整，設定值則是固定的上限
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "0"))
+READECK_CONCURRENCY = int(os.getenv("READECK_CONCURRENCY", "0"))
+INSTAPAPER_CONCURRENCY = int(os.getenv("INSTAPAPER_CONCURRENCY", "0"))
+READECK_DEDUPE = os.getenv("READECK_DEDUPE", "1") == "1"
+READECK_PAGE_SIZE = 100
+LEDGER_ENABLED = os.getenv("LEDGER", "1") == "1"
+SHARE_CLEANUP_CONCURRENCY = int(os.getenv("SHARE_CLEANUP_CONCURRENCY", "4"))
+# full：每次完整掃描 INBOX；incremental：依 /events cursor 只處理有變動的筆記
+SYNC_MODE = os.getenv("SYNC_MODE", "full")
+# 每次 sync 只處理 INBOX 中最近幾天建立的筆記；更早的筆記以 backfill 命令處理
+INBOX_WINDOW_DAYS = int(os.getenv("INBOX_WINDOW_DAYS", "2048"))
+EVENTS_CURSOR_TTL = int(os.getenv("EVENTS_CURSOR_TTL_DAYS", "30")) * 86400
+
+# 確認 Readeck 的非同步擷取結果：每次執行最多等待幾秒、輪詢間隔、每個請求查幾個書籤、
+# 每秒最多幾個請求，以及超過幾秒仍在擷取中就不再追蹤
+READECK_VERIFY = os.getenv("READECK_VERIFY", "1") == "1"
+READECK_VERIFY_WAIT = float(os.getenv("READECK_VERIFY_WAIT", "20"))
+READECK_VERIFY_INTERVAL = float(os.getenv("READECK_VERIFY_INTERVAL", "5"))
+READECK_VERIFY_BATCH = int(os.getenv("READECK_VERIFY_BATCH", "100"))
+READECK_VERIFY_RATE = float(os.getenv("READECK_VERIFY_RATE", "5"))
+READECK_VERIFY_TTL = float(os.getenv("READECK_VERIFY_TTL", "86400"))
+
+# Readeck 書籤的 state
+READECK_STATE_LOADED = 0
+READECK_STATE_ERROR = 1
+READECK_STATE_LOADING = 2
+
+# fail notebook 的重試：每次執行最多重試幾篇、exponential backoff 的起始與上限（秒）、最多重試幾次
+RETRY_BUDGET = int(os.getenv("RETRY_BUDGET", "20"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "3600"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", str(7 * 86400)))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "8"))
+
+# 每次執行的時間預算（秒，0 為不限制）：預估無法在預算內完成時不再派新的筆記；
+# CronJob 的 activeDeadlineSeconds 應大於 RUN_DEADLINE 加上清除 share 的時間
+RUN_DEADLINE = float(os.getenv("RUN_DEADLINE", "0"))
+RUN_DEADLINE_MARGIN = float(os.getenv("RUN_DEADLINE_MARGIN", "5"))
+CHECKPOINT_KEY = 'checkpoint'
+
+# 分片模式（SHARDS > 1）下續約與重新分配 lease 的間隔（秒）
+LEASE_RENEW_INTERVAL = float(os.getenv("LEASE_RENEW_INTERVAL", "5"))
+
+# backfill 命令：每段涵蓋的天數、同時處理的筆記數、每個上游每秒最多的請求數（0 為不限制）
+BACKFILL_CHUNK_DAYS = int(os.getenv("BACKFILL_CHUNK_DAYS", "30"))
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "8"))
+BACKFILL_RATE = float(os.getenv("BACKFILL_RATE", "10"))
+BACKFILL_KEY = 'backfill'
+# joplin-proxy 的 ALLOWED_FOLDER_IDS（逗號分隔）；backfill 以此檢查要補發佈的 notebook 能否被公開讀取
+PROXY_ALLOWED_FOLDER_IDS = {s.strip() for s in os.getenv("PROXY_ALLOWED_FOLDER_IDS", "").split(",") if s.strip()}
+
+# plan 命令：上次執行的 metrics 與本次查詢都沒有量測到的 endpoint，以此延遲（秒）估算
+PLAN_DEFAULT_LATENCY = float(os.getenv("PLAN_DEFAULT_LATENCY", "0.2"))
+# 估算時代替路徑中的 note / tag / share ID，endpoint 名稱會合併成 {id}
+PLAN_ID = '0' * 32
+
+# daemon 模式：輪詢間隔、health endpoint、session / 索引 / share 清除的更新週期（秒）
+DAEMON_MIN_INTERVAL = float(os.getenv("DAEMON_MIN_INTERVAL", "15"))
+DAEMON_MAX_INTERVAL = float(os.getenv("DAEMON_MAX_INTERVAL", "300"))
+DAEMON_HEALTH_PORT = int(os.getenv("DAEMON_HEALTH_PORT", "8080"))
+DAEMON_HEALTH_STALE = float(os.getenv("DAEMON_HEALTH_STALE", "900"))
+DAEMON_SESSION_TTL = float(os.getenv("DAEMON_SESSION_TTL", "21600"))
+DAEMON_INDEX_TTL = float(os.getenv("DAEMON_INDEX_TTL", "3600"))
+DAEMON_CLEANUP_INTERVAL = float(os.getenv("DAEMON_CLEANUP_INTERVAL", "3600"))
+
+# Joplin /events 的 item_type 與 type
+ITEM_TYPE_NOTE = 1
+EVENT_CREATED = 1
+EVENT_UPDATED = 2
+
+EVENTS_CURSOR_KEY = 'events_cursor'
+INBOX_PENDING_KEY = 'inbox_pending'
+
+# 只用環境變數設定時的單一帳號；多帳號時由 ACCOUNTS_FILE 設定
+DEFAULT_ACCOUNT = account_from_env()
+ACCOUNTS_FILE = os.getenv("ACCOUNTS_FILE")
+
+def add_to_instapaper(url: str, title: str = None, selection: str = None,
+                      username: str = None, password: str = None) -> bool:
     """
-    將指定的文章 URL 加入 Instapaper。
-    回傳 True 表示成功，False 表示失敗。
+    將指定的文章 URL 加入 Instapaper（username / password 預設為 INSTAPAPER_USERNAME / PASSWORD）。
+    回傳 True 表示成功，False 表示失敗；網路錯誤、429、5xx 會丟出 requests.RequestException。
     """
-    if not USERNAME or not PASSWORD:
+    username = username or USERNAME
+    password = password or PASSWORD
+    if not username or not password:
         raise ValueError("請在 .env 檔中設定 INSTAPAPER_USERNAME 和 INSTAPAPER_PASSWORD")
 
-    endpoint = "https://www.instapaper.com/api/add"
+    endpoint = f"{INSTAPAPER_URL}/api/add"
     payload = {"url": url}
 
     # 可選參數
@@ -41,20 +138,23 @@ def add_to_instapaper(url: str, title: str = None, selection: str = None) -> boo
         payload["selection"] = selection
 
     try:
-        response = requests.post(endpoint, data=payload, auth=HTTPBasicAuth(USERNAME, PASSWORD))
-        if response.status_code == 201:
-            print(f"✅ 已成功加入 Instapaper: {url}")
-            return True
-        elif response.status_code == 400:
-            print("❌ 錯誤：缺少參數或 URL 無效")
-        elif response.status_code == 403:
-            print("❌ 登入失敗：帳號或密碼錯誤")
-        else:
-            print(f"⚠️ 其他錯誤: {response.status_code}, 回應: {response.text}")
-        return False
+        response = get_upstream("instapaper", endpoint).post(endpoint, data=payload, auth=HTTPBasicAuth(username, password))
     except requests.RequestException as e:
         print(f"🚫 網路錯誤：{e}")
-        return False
+        raise
+
+    if response.status_code == 201:
+        print(f"✅ 已成功加入 Instapaper: {url}")
+        return True
+    elif response.status_code == 400:
+        print("❌ 錯誤：缺少參數或 URL 無效")
+    elif response.status_code == 403:
+        print("❌ 登入失敗：帳號或密碼錯誤")
+    else:
+        print(f"⚠️ 其他錯誤: {response.status_code}, 回應: {response.text}")
+        # 429、5xx 為暫時性錯誤，交由呼叫端保留筆記下次再試
+        raise_for_transient(response)
+    return False
 
 
 def format_ym_week(date_str: str = None) -> str:
@@ -72,6 +172,91 @@ def format_ym_week(date_str: str = None) -> str:
     return f"{date.strftime('%Y%m')}{week_of_month:02d}"
 
 
+class JoplinIndex:
+    """
+    一次執行內共用的 tag / folder 名稱 → ID 索引。
+
+    第一次查詢時以分頁完整掃描 /tags 或 /folders 一次，之後的查詢都在記憶體中完成；
+    本次執行建立的 tag / folder 也會直接寫回索引。
+    """
+
+    def __init__(self, api_base_url: str, token: str):
+        self.api_base_url = api_base_url
+        self.token = token
+        self.lock = threading.RLock()
+        self._names: Dict[str, Dict[str, str]] = {}
+
+    def _scan(self, kind: str) -> Dict[str, str]:
+        names = {}
+        page = 1
+
+        while True:
+            response = get_upstream("joplin", self.api_base_url).get(f"{self.api_base_url}/{kind}", params={
+                'token': self.token,
+                'fields': 'id,title',
+                'limit': 100,
+                'page': page
+            })
+            response.raise_for_status()
+            data = response.json()
+            for item in data.get('items', []):
+                # 同名時保留第一個，與逐頁查找的結果一致
+                names.setdefault(item['title'], item['id'])
+            if not data.get('has_more'):
+                break
+
+            page += 1
+
+        return names
+
+    def _get(self, kind: str) -> Dict[str, str]:
+        with self.lock:
+            if kind not in self._names:
+                self._names[kind] = self._scan(kind)
+            return self._names[kind]
+
+    def tag_id(self, name: str) -> Optional[str]:
+        return self._get('tags').get(name)
+
+    def folder_id(self, name: str) -> Optional[str]:
+        return self._get('folders').get(name)
+
+    def tags(self) -> Dict[str, str]:
+        """回傳所有 tag 名稱 → ID。"""
+        with self.lock:
+            return dict(self._get('tags'))
+
+    def folders(self) -> Dict[str, str]:
+        """回傳所有 notebook 名稱 → ID。"""
+        with self.lock:
+            return dict(self._get('folders'))
+
+    def add_tag(self, name: str, tag_id: str):
+        self._get('tags')[name] = tag_id
+
+    def add_folder(self, name: str, folder_id: str):
+        self._get('folders')[name] = folder_id
+
+
+_indexes: Dict[tuple, JoplinIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(api_base_url: str, token: str) -> JoplinIndex:
+    """取得此 Joplin 帳號在本次執行中的 tag / folder 索引。"""
+    with _indexes_lock:
+        key = (api_base_url, token)
+        if key not in _indexes:
+            _indexes[key] = JoplinIndex(api_base_url, token)
+        return _indexes[key]
+
+
+def reset_indexes():
+    """清除所有索引，下一次查詢會重新掃描。"""
+    with _indexes_lock:
+        _indexes.clear()
+
+
 def ensure_yearmonth_tag(api_base_url, token, yearmonth=None):
     """
     確保 Joplin 中存在指定的 yearmonth 標籤（格式: 'YYYYMM'），若不存在則建立。
@@ -84,26 +269,24 @@ def ensure_yearmonth_tag(api_base_url, token, yearmonth=None):
     if yearmonth is None:
         yearmonth = datetime.now().strftime("%Y%m")
 
-    # 1. 查詢是否已有此標籤
-    res = requests.get(f"{api_base_url}/tags", params={'token': token})
-    res.raise_for_status()
-    tags = res.json().get('items', [])
-
-    for tag in tags:
-        if tag['title'] == yearmonth:
-            print(f"Tag '{yearmonth}' already exists with ID: {tag['id']}")
-            return tag['id']
-
-    # 2. 若無，則建立新標籤
-    res = requests.post(
-        f"{api_base_url}/tags",
-        json={"title": yearmonth}, 
-        params={'token': token}
-    )
-    res.raise_for_status()
-    tag = res.json()
-    print(f"Created tag '{yearmonth}' with ID: {tag['id']}")
-    return tag['id']
+    index = get_index(api_base_url, token)
+    with index.lock:
+        # 1. 查詢是否已有此標籤
+        tag_id = index.tag_id(yearmonth)
+        if tag_id:
+            return tag_id
+
+        # 2. 若無，則建立新標籤
+        res = get_upstream("joplin", api_base_url).post(
+            f"{api_base_url}/tags",
+            json={"title": yearmonth}, 
+            params={'token': token}
+        )
+        res.raise_for_status()
+        tag = res.json()
+        index.add_tag(yearmonth, tag['id'])
+        print(f"Created tag '{yearmonth}' with ID: {tag['id']}")
+        return tag['id']
 
 
 def apply_tag_to_note(api_base_url, token, tag_id, note_id):
@@ -120,7 +303,7 @@ def apply_tag_to_note(api_base_url, token, tag_id, note_id):
         "id": note_id
     }
 
-    res = requests.post(url, json=payload, params={'token': token})
+    res = get_upstream("joplin", api_base_url).post(url, json=payload, params={'token': token})
     
     if res.status_code == 200:
         print(f"Tag {tag_id} successfully applied to note {note_id}")
@@ -130,60 +313,249 @@ def apply_tag_to_note(api_base_url, token, tag_id, note_id):
         res.raise_for_status()
 
 
-def check_tag_on_note(api_base_url, token, tag_id, note_id):
+def create_readeck_bookmark(bookmark_url, title=None, labels: Optional[List[str]] = None,
+                            readeck_url: str = None, token: str = None) -> Optional[str]:
     """
-    check tag on note
+    建立 Readeck 書籤。Readeck 回 202 後才在背景擷取頁面。
 
-    :param api_base_url: Joplin API base URL，例如 http://localhost:41184
-    :param token: Joplin API token
-    :param tag_id: tag ID
-    :param note_id: note ID
+    Returns:
+        Optional[str]: 202 時回傳 Bookmark-Id header（沒有時為空字串），其他狀態回傳 None；
+        網路錯誤、429、5xx 會丟出 requests.RequestException
     """
-    url = f"{api_base_url}/notes/{note_id}/tags"
-
-    res = requests.get(url, params={'token': token})
-    
-    if res.status_code == 200:
-        if tag_id in res.text:
-            #print (f"note_id:{note_id} tag_id:{tag_id} tags:{res.text}")
-            return True
-        else:
-            return False
-    else:
-        res.raise_for_status()
-
-
-def add_to_readeck(bookmark_url, title=None, tags=[]):
     # API endpoint to create a new bookmark
-    endpoint = f"{READECK_URL}/api/bookmarks"
+    endpoint = f"{readeck_url or READECK_URL}/api/bookmarks"
 
     # Prepare headers and payload
     headers = {
-        "Authorization": f"Bearer {READECK_TOKEN}",
+        "Authorization": f"Bearer {token or READECK_TOKEN}",
         "Content-Type": "application/json",
     }
 
-    tags.append(format_ym_week())
+    if labels is None:
+        labels = [format_ym_week()]
 
     payload = {
         "url": bookmark_url,
         "title": title,
-        "labels": tags
+        "labels": labels
     }
     #print (payload)
 
     # Send the request
-    response = requests.post(endpoint, json=payload, headers=headers)
+    try:
+        response = get_upstream("readeck", endpoint).post(endpoint, json=payload, headers=headers)
+    except requests.RequestException as e:
+        print(f"🚫 網路錯誤：{e}")
+        raise
 
     # Handle the response
     if response.status_code == 202:
-        return True
+        return response.headers.get("Bookmark-Id", "")
     else:
-        return False
+        raise_for_transient(response)
+        return None
+
+
+def get_readeck_bookmark_urls(url_prefix: str, readeck_url: str = None, token: str = None) -> Set[str]:
+    """
+    一次分頁取得 Readeck 中網址以 url_prefix 開頭的書籤（以 site 過濾）。
+
+    Args:
+        url_prefix (str): 筆記公開網址前綴，例如 https://notes.example.com/dany
+        readeck_url (str, optional): Readeck URL，預設為 READECK_URL
+        token (str, optional): Readeck API token，預設為 READECK_TOKEN
+
+    Returns:
+        Set[str]: 已存在書籤的 URL（去除結尾的 /）
+    """
+    endpoint = f"{readeck_url or READECK_URL}/api/bookmarks"
+    headers = {"Authorization": f"Bearer {token or READECK_TOKEN}"}
+    site = urlparse(url_prefix).hostname
+    urls = set()
+    offset = 0
+
+    while True:
+        response = get_upstream("readeck", endpoint).get(endpoint, headers=headers, params={
+            'site': site,
+            'limit': READECK_PAGE_SIZE,
+            'offset': offset
+        })
+        response.raise_for_status()
+        items = response.json()
+        for bookmark in items:
+            url = (bookmark.get('url') or '').rstrip('/')
+            if url.startswith(url_prefix):
+                urls.add(url)
+        if len(items) < READECK_PAGE_SIZE:
+            break
+
+        offset += READECK_PAGE_SIZE
+
+    return urls
+
+
+class ReadeckDedupe:
+    """
+    發佈前比對 Readeck 既有書籤；已存在的 URL 不再 POST，直接視為成功。
+
+    書籤清單在第一次比對時才載入，INBOX 為空時不會呼叫 Readeck。
+    """
+
+    def __init__(self, url_prefix: str, readeck_url: str = None, token: str = None):
+        self.url_prefix = url_prefix
+        self.readeck_url = readeck_url
+        self.token = token
+        self.lock = threading.Lock()
+        self._urls: Optional[Set[str]] = None
+
+    def exists(self, url: str) -> bool:
+        with self.lock:
+            if self._urls is None:
+                try:
+                    self._urls = get_readeck_bookmark_urls(self.url_prefix, self.readeck_url, self.token)
+                    print (f"readeck: {len(self._urls)} existing bookmarks")
+                except (requests.RequestException, ValueError) as e:
+                    print (f"⚠️ 無法取得 Readeck 書籤清單，略過重複檢查: {e}")
+                    self._urls = set()
+            return url.rstrip('/') in self._urls
+
+    def add(self, url: str):
+        with self.lock:
+            if self._urls is not None:
+                self._urls.add(url.rstrip('/'))
+
+
+def get_readeck_bookmark_states(bookmark_ids: List[str], readeck_url: str = None,
+                                token: str = None) -> Dict[str, int]:
+    """
+    以一個請求查詢多個書籤的擷取狀態（GET /api/bookmarks?id=...&id=...）。
+
+    Returns:
+        Dict[str, int]: 書籤 ID → state；已被刪除的書籤不在其中
+    """
+    readeck_url = readeck_url or READECK_URL
+    response = get_upstream("readeck", readeck_url).get(f"{readeck_url}/api/bookmarks",
+                                                        headers={"Authorization": f"Bearer {token or READECK_TOKEN}"},
+                                                        params=[('id', bookmark_id) for bookmark_id in bookmark_ids]
+                                                        + [('limit', len(bookmark_ids))])
+    response.raise_for_status()
+    return {item['id']: item.get('state', READECK_STATE_LOADED) for item in response.json()}
+
+
+def delete_readeck_bookmark(bookmark_id: str, readeck_url: str = None, token: str = None) -> bool:
+    readeck_url = readeck_url or READECK_URL
+    response = get_upstream("readeck", readeck_url).delete(f"{readeck_url}/api/bookmarks/{bookmark_id}",
+                                                           headers={"Authorization": f"Bearer {token or READECK_TOKEN}"})
+    return response.status_code in (200, 204)
 
 
-def get_session(user, passwd):
-    url = f"{SERVER_URL}/api/sessions"
+class ReadeckVerifier:
+    """
+    確認 Readeck 的非同步擷取結果。
+
+    本次執行建立的書籤 ID 先存入 state store，執行結束前每 READECK_VERIFY_INTERVAL 秒
+    以每次 READECK_VERIFY_BATCH 個 ID、每秒最多 READECK_VERIFY_RATE 個請求輪詢；
+    等不到結果的留給下一次執行。擷取失敗的書籤會被刪除，筆記移回 fail，
+    並在 ledger 記為 readeck 推送失敗，由 fail notebook 的重試重新推送。
+
+    Args:
+        account (Account): 書籤所屬的帳號
+    """
+
+    def __init__(self, account: Account = DEFAULT_ACCOUNT):
+        self.account = account
+        self.pending = PendingBookmarks(get_store(), account.namespace)
+
+    def add(self, bookmark_id: str, note_id: str, url: str):
+        if bookmark_id:
+            self.pending.add(bookmark_id, note_id, url)
+
+    def _states(self, entries: List[Dict]) -> Dict[str, int]:
+        states = {}
+        for start in range(0, len(entries), READECK_VERIFY_BATCH):
+            if start:
+                time.sleep(1 / READECK_VERIFY_RATE)
+            batch = [entry['bookmark_id'] for entry in entries[start:start + READECK_VERIFY_BATCH]]
+            states.update(get_readeck_bookmark_states(batch, self.account.readeck_url, self.account.readeck_token))
+        return states
+
+    def verify(self, fail_nb_id: str, wait: float = READECK_VERIFY_WAIT) -> Tuple[int, int]:
+        """
+        輪詢到全部有結果或等待超過 wait 秒為止。
+
+        Returns:
+            Tuple[int, int]: (擷取成功數, 擷取失敗並移回 fail 的筆記數)
+        """
+        leases = get_leases()
+        self.pending.expire(time.time() - READECK_VERIFY_TTL)
+        entries = [e for e in self.pending.list() if leases is None or leases.owns(e['note_id'])]
+        loaded = 0
+        failed = []
+        until = time.monotonic() + max(wait, 0)
+
+        with get_metrics().stage('verifying'):
+            while entries:
+                try:
+                    states = self._states(entries)
+                except (requests.RequestException, ValueError) as e:
+                    print (f"⚠️ [{self.account.name}] 無法查詢 Readeck 擷取狀態，下次再確認: {e}")
+                    break
+
+                remaining = []
+                for entry in entries:
+                    state = states.get(entry['bookmark_id'])
+                    if state == READECK_STATE_LOADING:
+                        remaining.append(entry)
+                        continue
+                    if state == READECK_STATE_ERROR:
+                        failed.append(entry)
+                        continue
+                    if state is not None:
+                        loaded += 1
+                    # 擷取成功或已被刪除的書籤不再追蹤
+                    self.pending.remove(entry['bookmark_id'])
+                entries = remaining
+
+                if not entries or time.monotonic() + READECK_VERIFY_INTERVAL > until:
+                    break
+                time.sleep(READECK_VERIFY_INTERVAL)
+
+        for entry in failed:
+            self._fail(entry, fail_nb_id)
+        if loaded or failed or entries:
+            print (f"[{self.account.name}] readeck extraction: {loaded} loaded, {len(failed)} failed, "
+                   f"{len(entries)} still loading")
+        get_metrics().count('extraction_failed', len(failed))
+        return loaded, len(failed)
+
+    def _fail(self, entry: Dict, fail_nb_id: str):
+        note_id = entry['note_id']
+        account = self.account
+        try:
+            moved = move_note_to_notebook(account.api_url, account.api_token, note_id, fail_nb_id)
+        except requests.RequestException as e:
+            moved = False
+            print (f"🚫 [{account.name}] {e}")
+        if not moved:
+            # 保留紀錄，下次執行再移
+            print (f"🚫 [{account.name}] 無法將擷取失敗的筆記移到 fail: {note_id}")
+            return
+
+        ledger = get_ledger()
+        if ledger:
+            ledger.record(note_id, 'readeck', 'push', entry['url'], 'failed')
+            ledger.record(note_id, 'joplin', 'move', entry['url'], 'failed')
+        # 刪除失敗的書籤，重試時才不會被視為已存在而略過
+        try:
+            delete_readeck_bookmark(entry['bookmark_id'], account.readeck_url, account.readeck_token)
+        except requests.RequestException as e:
+            print (f"⚠️ [{account.name}] 無法刪除書籤 {entry['bookmark_id']}: {e}")
+        self.pending.remove(entry['bookmark_id'])
+        print (f"readeck extraction failed, move to fail:\t {note_id}")
+
+
+def get_session(user, passwd, server_url=None):
+    url = f"{server_url or SERVER_URL}/api/sessions"
     headers = {
         'Content-Type': 'application/json; charset=UTF-8',
         'X-Accept': 'application/json'
@@ -193,15 +565,15 @@ def get_session(user, passwd):
         'password': passwd,
     }
 
-    res = requests.post(url, json=data, headers=headers)
+    res = get_upstream("joplin_server", url).post(url, json=data, headers=headers)
 
     if res.status_code != 200:
         return None
     return res.json()['id']
 
 
-def publish_note(token, note_id):
-    url = f"{SERVER_URL}/api/shares"
+def publish_note(token, note_id, server_url=None):
+    url = f"{server_url or SERVER_URL}/api/shares"
     headers = {
         'Content-Type': 'application/json; charset=UTF-8',
         'X-Accept': 'application/json',
@@ -212,7 +584,7 @@ def publish_note(token, note_id):
         'recursive': 0
     }
 
-    res = requests.post(url, json=data, headers=headers)
+    res = get_upstream("joplin_server", url).post(url, json=data, headers=headers)
 
     if res.status_code != 200:
         return False
@@ -220,30 +592,30 @@ def publish_note(token, note_id):
         return True
 
 
-def get_shares(token):
-    url = f"{SERVER_URL}/api/shares"
+def get_shares(token, server_url=None):
+    url = f"{server_url or SERVER_URL}/api/shares"
     headers = {
         'Content-Type': 'application/json; charset=UTF-8',
         'X-Accept': 'application/json',
         'X-Api-Auth': token
     }
 
-    res = requests.get(url, headers=headers)
+    res = get_upstream("joplin_server", url).get(url, headers=headers)
 
     if res.status_code != 200:
         return None
     return res.json()['items']
 
 
-def del_share(token, item):
-    url = f"{SERVER_URL}/api/shares/{item['id']}"
+def del_share(token, item, server_url=None):
+    url = f"{server_url or SERVER_URL}/api/shares/{item['id']}"
     headers = {
         'Content-Type': 'application/json; charset=UTF-8',
         'X-Accept': 'application/json',
         'X-Api-Auth': token
     }
 
-    res = requests.delete(url, headers=headers)
+    res = get_upstream("joplin_server", url).delete(url, headers=headers)
 
     if res.status_code != 200:
         return False
@@ -258,10 +630,14 @@ def get_filtered_notes(
     created_before: Optional[datetime] = None,
     notebook_id: Optional[str] = None,
     tag_id: Optional[str] = None,
-    fields: str = 'id,title,created_time,parent_id'
-) -> List[Dict]:
+    fields: str = 'id,title,created_time,parent_id',
+    rescan: bool = False
+) -> Iterator[Dict]:
     """
-    從 Joplin Data API 取得符合條件的筆記。
+    從 Joplin Data API 逐筆取得符合條件的筆記（generator）。
+
+    指定 notebook 時直接查詢 /folders/{id}/notes；結果依 created_time 遞增排序，
+    超過 created_before 後即停止分頁。呼叫端處理目前這一頁時，下一頁已在背景下載。
 
     Args:
         api_base_url (str): Joplin API URL，例如 http://localhost:41184
@@ -271,43 +647,186 @@ def get_filtered_notes(
         notebook_id (str, optional): 指定 notebook ID（parent_id）
         tag_id (str, optional): 指定 tag ID，會只抓該標籤下的筆記
         fields (str): 取得哪些欄位（預設 id, title, created_time, parent_id）
+        rescan (bool): 掃到底後從第一頁再掃，直到沒有新的筆記；只有呼叫端會把筆記移出 notebook 時需要
 
-    Returns:
-        List[Dict]: 筆記 dict 清單
+    Yields:
+        Dict: 筆記 dict
     """
     after_ts = int(created_after.timestamp() * 1000) if created_after else None
     before_ts = int(created_before.timestamp() * 1000) if created_before else None
 
-    notes = []
-    page = 1
-    endpoint = f"{api_base_url}/tags/{tag_id}/notes" if tag_id else f"{api_base_url}/notes"
+    if tag_id:
+        endpoint = f"{api_base_url}/tags/{tag_id}/notes"
+    elif notebook_id:
+        endpoint = f"{api_base_url}/folders/{notebook_id}/notes"
+    else:
+        endpoint = f"{api_base_url}/notes"
+
+    def fetch(page):
+        with get_metrics().stage('listing'):
+            response = get_upstream("joplin", api_base_url).get(endpoint, params={
+                'token': token,
+                'fields': fields,
+                'order_by': 'created_time',
+                'order_dir': 'ASC',
+                'limit': 100,
+                'page': page
+            })
+            response.raise_for_status()
+            return response.json()
+
+    # 呼叫端把筆記移出 notebook 時，/folders/{id}/notes 的分頁位移會因此跳過部分筆記；
+    # 掃到底後從第一頁再掃一次，直到沒有新的筆記為止（此時剩下的多半只有一頁）
+    rescan = rescan and bool(notebook_id and not tag_id)
+    seen = set()
+
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        while True:
+            page = 1
+            found = 0
+            future = prefetcher.submit(fetch, page)
+
+            while True:
+                data = future.result()
+                items = data.get('items', [])
+                has_more = bool(items) and data.get('has_more', True)
+                if has_more:
+                    future = prefetcher.submit(fetch, page + 1)
+
+                for note in items:
+                    if before_ts and note['created_time'] >= before_ts:
+                        return
+                    if note['id'] in seen:
+                        continue
+                    seen.add(note['id'])
+                    if notebook_id and note.get('parent_id') != notebook_id:
+                        continue
+                    if after_ts and note['created_time'] <= after_ts:
+                        continue
+                    found += 1
+                    yield note
+
+                if not has_more:
+                    break
+
+                page += 1
+
+            if not rescan or found == 0:
+                break
+
+
+def get_latest_event_cursor(api_base_url: str, token: str) -> str:
+    """
+    取得 Joplin Data API 目前最新的 /events cursor（不帶 cursor 呼叫時只回傳 cursor）。
+    """
+    response = get_upstream("joplin", api_base_url).get(f"{api_base_url}/events", params={'token': token})
+    response.raise_for_status()
+    return str(response.json()['cursor'])
+
+
+def get_changed_note_ids(api_base_url: str, token: str, cursor: str) -> Tuple[List[str], str]:
+    """
+    讀取 cursor 之後的 /events，回傳有建立或更新的 note ID 與新的 cursor。
+
+    Args:
+        api_base_url (str): Joplin API base URL
+        token (str): Joplin API token
+        cursor (str): 上次執行保存的 cursor
+
+    Returns:
+        Tuple[List[str], str]: (依事件順序去重的 note ID 清單, 新的 cursor)
+    """
+    note_ids = {}
 
     while True:
-        response = requests.get(endpoint, params={
+        response = get_upstream("joplin", api_base_url).get(f"{api_base_url}/events", params={
             'token': token,
-            'fields': fields,
-            'order_by': 'created_time',
-            'order_dir': 'ASC',
-            'limit': 100,
-            'page': page
+            'cursor': cursor
         })
         response.raise_for_status()
-        items = response.json().get('items', [])
-        if not items:
+        data = response.json()
+        for event in data.get('items', []):
+            # 移動筆記到 INBOX 也是一次 update 事件
+            if event.get('item_type') == ITEM_TYPE_NOTE and event.get('type') in (EVENT_CREATED, EVENT_UPDATED):
+                note_ids[event['item_id']] = True
+        cursor = str(data.get('cursor', cursor))
+        if not data.get('has_more'):
             break
 
-        for note in items:
-            if notebook_id and note.get('parent_id') != notebook_id:
-                continue
-            if after_ts and note['created_time'] <= after_ts:
-                continue
-            if before_ts and note['created_time'] >= before_ts:
-                continue
-            notes.append(note)
+    return list(note_ids), cursor
+
+
+def get_note(api_base_url: str, token: str, note_id: str, fields: str = 'id,title,created_time,parent_id') -> Optional[Dict]:
+    """取得單一筆記，已刪除時回傳 None。"""
+    response = get_upstream("joplin", api_base_url).get(f"{api_base_url}/notes/{note_id}", params={'token': token, 'fields': fields})
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def get_inbox_notes(
+    api_base_url: str,
+    token: str,
+    notebook_id: str,
+    created_after: Optional[datetime] = None,
+    mode: str = 'full',
+    account: Account = DEFAULT_ACCOUNT,
+    rescan: bool = True
+) -> Tuple[Iterable[Dict], Optional[str]]:
+    """
+    取得 INBOX 中待處理的筆記；完整掃描時回傳 generator，可邊下載邊發佈。
+
+    incremental 模式只檢查上次 cursor 之後建立或移入的筆記，加上上次留在 INBOX 的筆記；
+    cursor 不存在、過期或 /events 無法使用時退回完整掃描。完整掃描預設會重掃（筆記在掃描中被移出
+    INBOX），只讀取不移動的呼叫端（plan）以 rescan=False 關閉。
+
+    Returns:
+        Tuple[Iterable[Dict], Optional[str]]: (筆記, 處理完成後要保存的 cursor)
+    """
+    if mode != 'incremental':
+        return get_filtered_notes(api_base_url, token, created_after, None, notebook_id, rescan=rescan), None
+
+    store = get_store()
+    cursor, saved_at = store.get_with_time(account.key(EVENTS_CURSOR_KEY))
+    expired = saved_at is not None and time.time() - saved_at > EVENTS_CURSOR_TTL
 
-        page += 1
+    try:
+        if cursor is None or expired:
+            print ("events cursor missing or expired, full scan")
+            # 先取 cursor 再掃描，掃描期間的變更留給下一次
+            new_cursor = get_latest_event_cursor(api_base_url, token)
+            return get_filtered_notes(api_base_url, token, created_after, None, notebook_id,
+                                      rescan=rescan), new_cursor
+
+        note_ids, new_cursor = get_changed_note_ids(api_base_url, token, cursor)
+    except requests.RequestException as e:
+        print (f"events unavailable ({e}), full scan")
+        return get_filtered_notes(api_base_url, token, created_after, None, notebook_id, rescan=rescan), None
+
+    after_ts = int(created_after.timestamp() * 1000) if created_after else None
+    candidates = dict.fromkeys(store.get(account.key(INBOX_PENDING_KEY), []) + note_ids)
+    notes = []
+    for note_id in candidates:
+        with get_metrics().stage('listing'):
+            note = get_note(api_base_url, token, note_id)
+        if note is None or note.get('parent_id') != notebook_id:
+            continue
+        if after_ts and note['created_time'] <= after_ts:
+            continue
+        notes.append(note)
 
-    return notes
+    notes.sort(key=lambda note: note['created_time'])
+    print (f"events: {len(note_ids)} changed notes, {len(notes)} in inbox")
+    return notes, new_cursor
+
+
+def save_sync_state(cursor: Optional[str], pending_ids: List[str], account: Account = DEFAULT_ACCOUNT):
+    """處理完成後保存 cursor 與仍留在 INBOX 的筆記 ID。"""
+    store = get_store()
+    if cursor is not None:
+        store.set(account.key(EVENTS_CURSOR_KEY), cursor)
+    store.set(account.key(INBOX_PENDING_KEY), pending_ids)
 
 
 def get_notebook_id_by_name(
@@ -326,35 +845,71 @@ def get_notebook_id_by_name(
     Returns:
         Optional[str]: 找到的 notebook ID，如果沒找到則回傳 None
     """
-    page = 1
+    index = get_index(api_base_url, token)
+    with index.lock:
+        folder_id = index.folder_id(notebook_name)
+        if folder_id:
+            return folder_id
+
+        # 若不存在，建立一個新的 notebook
+        create_response = get_upstream("joplin", api_base_url).post(f"{api_base_url}/folders", json={ 'title': notebook_name }, params={'token': token})
+
+        if create_response.status_code == 200:
+            folder_id = create_response.json().get('id')
+            index.add_folder(notebook_name, folder_id)
+            return folder_id
+        else:
+            print("建立 notebook 失敗:", create_response.status_code, create_response.text)
+            return None
 
-    while True:
-        response = requests.get(f"{api_base_url}/folders", params={
-            'token': token,
-            'limit': 100,
-            'page': page
-        })
-        response.raise_for_status()
-        items = response.json().get('items', [])
-        if not items:
-            break
 
-        for folder in items:
-            if folder['title'] == notebook_name:
-                return folder['id']
+def load_note_tags(api_base_url: str, token: str) -> Dict[str, List[str]]:
+    """
+    批次取得所有筆記的 tag：對每個 tag 分頁讀取 /tags/{id}/notes，不需逐篇查詢 /notes/{id}/tags。
+
+    note2read 自己套用的 yearmonth tag 不轉成 label，因此略過不讀。
 
-        page += 1
+    Returns:
+        Dict[str, List[str]]: note ID → tag 名稱
+    """
+    tags = {name: tag_id for name, tag_id in get_index(api_base_url, token).tags().items()
+            if not is_yearmonth_tag(name)}
 
-    # 若不存在，建立一個新的 notebook
-    create_response = requests.post(f"{api_base_url}/folders", json={ 'title': notebook_name }, params={'token': token})
+    def notes_of(tag_id):
+        return [note['id'] for note in get_filtered_notes(api_base_url, token, tag_id=tag_id, fields='id')]
 
-    if create_response.status_code == 200:
-        return create_response.json().get('id')
-    else:
-        print("建立 notebook 失敗:", create_response.status_code, create_response.text)
-        return None
+    note_tags: Dict[str, List[str]] = {}
+    workers = pool_size(SYNC_CONCURRENCY, get_upstream("joplin", api_base_url))
+    with get_metrics().stage('labels'), ThreadPoolExecutor(max_workers=workers) as pool:
+        for name, note_ids in zip(tags, pool.map(notes_of, tags.values())):
+            for note_id in note_ids:
+                note_tags.setdefault(note_id, []).append(name)
+    return note_tags
 
-    return None
+
+def load_tags_of_note(api_base_url: str, token: str, note_id: str) -> List[str]:
+    """以 /notes/{id}/tags 取得單一筆記的 tag 名稱。"""
+    names = []
+    page = 1
+    with get_metrics().stage('labels'):
+        while True:
+            response = get_upstream("joplin", api_base_url).get(f"{api_base_url}/notes/{note_id}/tags", params={
+                'token': token,
+                'fields': 'id,title',
+                'limit': 100,
+                'page': page
+            })
+            response.raise_for_status()
+            data = response.json()
+            names += [tag['title'] for tag in data.get('items', [])]
+            if not data.get('has_more'):
+                return names
+            page += 1
+
+
+def label_tag_count(api_base_url: str, token: str) -> int:
+    """load_note_tags() 需要掃描的 tag 數（不含 yearmonth tag）。"""
+    return sum(1 for name in get_index(api_base_url, token).tags() if not is_yearmonth_tag(name))
 
 
 def get_tag_id_by_name(
@@ -373,26 +928,7 @@ def get_tag_id_by_name(
     Returns:
         Optional[str]: 找到的 tag ID，如果沒找到則回傳 None
     """
-    page = 1
-
-    while True:
-        response = requests.get(f"{api_base_url}/tags", params={
-            'token': token,
-            'limit': 100,
-            'page': page
-        })
-        response.raise_for_status()
-        items = response.json().get('items', [])
-        if not items:
-            break
-
-        for tag in items:
-            if tag['title'] == tag_name:
-                return tag['id']
-
-        page += 1
-
-    return None
+    return get_index(api_base_url, token).tag_id(tag_name)
 
 
 def move_note_to_notebook(
@@ -417,7 +953,7 @@ def move_note_to_notebook(
     url = f"{api_base_url}/notes/{note_id}"
     payload = {"parent_id": new_notebook_id}
 
-    response = requests.put(url, json=payload, params={ 'token': token })
+    response = get_upstream("joplin", api_base_url).put(url, json=payload, params={ 'token': token })
     if response.status_code == 200:
         return True
     else:
@@ -425,73 +961,1264 @@ def move_note_to_notebook(
         return False
 
 
-def pub2instapaper(session_id, items, dest_nb_id, fail_nb_id):
-    for note in items:
-        note_id = note['id']
-        note_title = note['title']
+_ledger = None
+
+
+def get_ledger() -> Optional[Ledger]:
+    """
+    取得本機的推送紀錄；LEDGER=0 或 STATE_DIR 無法寫入時回傳 None（不使用紀錄）。
+    """
+    global _ledger
+    if not LEDGER_ENABLED:
+        return None
+    if _ledger is None:
+        try:
+            _ledger = Ledger(get_store())
+        except (OSError, sqlite3.Error) as e:
+            print (f"⚠️ ledger 無法使用，略過: {e}")
+            return None
+    return _ledger
+
+
+_retry_queues: Dict[str, RetryQueue] = {}
+
 
-        tag_id = ensure_yearmonth_tag(API_URL, API_TOKEN)
-        apply_tag_to_note(API_URL, API_TOKEN, tag_id, note_id)
-        if add_to_instapaper(f"{NOTES_URL}{NOTES_URL_PREFIX}/n/{note_id}", title = note_title):
-            print (f"add url to instapaper:\t{note_title}")
-            if move_note_to_notebook(API_URL, API_TOKEN, note_id, dest_nb_id):
-                print (f"move to notebook {str_year}:\t {note_title}")
+def get_retry_queue(account: Account = DEFAULT_ACCOUNT) -> Optional[RetryQueue]:
+    """取得此帳號 fail notebook 的重試排程；STATE_DIR 無法寫入時回傳 None（不重試）。"""
+    if account.namespace not in _retry_queues:
+        try:
+            _retry_queues[account.namespace] = RetryQueue(get_store(), account.namespace)
+        except (OSError, sqlite3.Error) as e:
+            print (f"⚠️ retry queue 無法使用，略過: {e}")
+            return None
+    return _retry_queues[account.namespace]
+
+
+def get_verifier(account: Account = DEFAULT_ACCOUNT) -> Optional[ReadeckVerifier]:
+    """READECK_VERIFY 開啟且此帳號有 Readeck 時回傳擷取檢查；STATE_DIR 無法寫入時回傳 None。"""
+    if not READECK_VERIFY or account.readeck_token is None:
+        return None
+    try:
+        return ReadeckVerifier(account)
+    except (OSError, sqlite3.Error) as e:
+        print (f"⚠️ 無法確認 Readeck 擷取結果，略過: {e}")
+        return None
+
+
+def pool_size(concurrency: int, *upstreams: Upstream) -> int:
+    """
+    worker pool 大小：設定值大於 0 時為固定上限；0 時為上游 AIMD 並行上限中最大的，
+    由各上游的 limiter 決定實際的並行數，worker pool 不會把 AIMD 限制在初始值以下。
+    """
+    if concurrency > 0:
+        return concurrency
+    return max([upstream.limiter.maximum for upstream in upstreams] + [1])
+
+
+def note_workers(account: Account, concurrencies: Iterable[int] = ()) -> int:
+    """同時處理的筆記數：account.concurrency，為 0 時涵蓋 Joplin 與各目的地的並行上限。"""
+    if account.concurrency > 0:
+        return account.concurrency
+    return max([pool_size(0, get_upstream("joplin", account.api_url))] + list(concurrencies))
+
+
+class Destination:
+    """
+    一個發佈目的地（Readeck、Instapaper），各自有獨立的 worker pool 限制同時推送數，
+    以及跨執行共用的 circuit breaker。
+
+    Args:
+        name (str): 目的地名稱
+        publish (Callable): 推送函式 publish(url, note) -> bool
+        concurrency (int): 同時推送數上限
+        breaker (str, optional): circuit breaker 名稱，預設與 name 相同；多帳號時每個帳號各自一個
+    """
+
+    def __init__(self, name, publish, concurrency=1, breaker=None):
+        self.name = name
+        self.publish = publish
+        self.concurrency = max(concurrency, 1)
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.breaker = get_breaker(breaker or name)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+def readeck_publisher(account: Account = DEFAULT_ACCOUNT, verifier: Optional[ReadeckVerifier] = None):
+    """
+    回傳 Readeck 的推送函式；labels 由筆記的 Joplin tag 加上本週 label 算出，
+    READECK_DEDUPE 開啟時先比對既有書籤，建立的書籤交給 verifier 確認擷取結果。
+    """
+    engine = LabelEngine(lambda: load_note_tags(account.api_url, account.api_token), format_ym_week(),
+                         load_note_tags=lambda note_id: load_tags_of_note(account.api_url, account.api_token,
+                                                                          note_id),
+                         tag_count=lambda: label_tag_count(account.api_url, account.api_token))
+    dedupe = None
+    if READECK_DEDUPE:
+        dedupe = ReadeckDedupe(f"{account.notes_url}{account.notes_url_prefix}",
+                               account.readeck_url, account.readeck_token)
+
+    def publish(url, note):
+        title = note['title']
+        if dedupe and dedupe.exists(url):
+            print (f"already in readeck, skip push:\t{title}")
+            return True
+        bookmark_id = create_readeck_bookmark(url, title=title, labels=engine.labels(note['id']),
+                                              readeck_url=account.readeck_url, token=account.readeck_token)
+        if bookmark_id is None:
+            return False
+        if dedupe:
+            dedupe.add(url)
+        if verifier:
+            verifier.add(bookmark_id, note['id'], url)
+        return True
+
+    return publish
+
+
+def instapaper_publisher(account: Account = DEFAULT_ACCOUNT):
+    """回傳以此帳號的 Instapaper 帳密推送的函式。"""
+    def publish(url, note):
+        return add_to_instapaper(url, title=note['title'], username=account.instapaper_username,
+                                 password=account.instapaper_password)
+
+    return publish
+
+
+def get_destinations(account: Account = DEFAULT_ACCOUNT,
+                     verifier: Optional[ReadeckVerifier] = None) -> List[Destination]:
+    """依帳號設定建立本次執行要發佈的目的地。"""
+    destinations = []
+    if account.readeck_token is not None:
+        concurrency = pool_size(READECK_CONCURRENCY, get_upstream("readeck", account.readeck_url or READECK_URL))
+        destinations.append(Destination('readeck', readeck_publisher(account, verifier), concurrency,
+                                        account.key('readeck')))
+    else:
+        print (f"[{account.name}] Do not publish to readeck")
+    if account.instapaper_username and account.instapaper_password:
+        concurrency = pool_size(INSTAPAPER_CONCURRENCY, get_upstream("instapaper", INSTAPAPER_URL))
+        destinations.append(Destination('instapaper', instapaper_publisher(account), concurrency,
+                                        account.key('instapaper')))
+    else:
+        print (f"[{account.name}] Do not publish to instapaper")
+    return destinations
+
+
+def publish_one(note, destinations, tag_id, dest_nb_id, fail_nb_id, account: Account = DEFAULT_ACCOUNT) -> Dict:
+    """
+    對單一筆記執行一次 tag，平行推送到所有目的地，再依合併結果移到單一 notebook。
+
+    全部目的地成功時移入年度 notebook，任一失敗時移入 fail；已在 ledger 記錄成功的
+    目的地不會重複推送。網路錯誤或目的地的 circuit breaker 開路時筆記留在 INBOX，
+    下次執行再處理。
+
+    Args:
+        note (Dict): 筆記 dict（至少含 id、title）
+        destinations (List[Destination]): 發佈目的地
+        tag_id (str): 要套用的 yearmonth tag ID
+        dest_nb_id (str): 成功時移入的 notebook ID；None 或與筆記所在 notebook 相同時不移動
+        fail_nb_id (str): 失敗時移入的 notebook ID
+        account (Account): 筆記所屬的帳號
+
+    Returns:
+        Dict: {'id', 'title', 'note', 'published', 'moved', 'error', 'deferred'}，published 為 {目的地: bool}，
+        deferred 表示因 circuit breaker 開路而未處理
+    """
+    note_id = note['id']
+    note_title = note['title']
+    url = account.note_url(note_id)
+    result = {'id': note_id, 'title': note_title, 'note': note, 'published': {}, 'moved': False, 'error': None,
+              'deferred': False}
+    ledger = get_ledger()
+    metrics = get_metrics()
+    metrics.count('notes')
+
+    try:
+        if ledger and ledger.done(note_id, 'joplin', 'move'):
+            # 上一輪已完整處理過，筆記又回到 INBOX，視為新的一輪
+            ledger.reset(note_id)
+
+        # 目的地開路中：不 tag、不推送，整篇留在 INBOX
+        blocked = [d.name for d in destinations
+                   if d.breaker.is_open() and not (ledger and ledger.done(note_id, d.name, 'push'))]
+        if blocked:
+            result['error'] = f"circuit open: {', '.join(blocked)}"
+            result['deferred'] = True
+            metrics.count('circuit_skipped')
+            return result
+
+        if not (ledger and ledger.done(note_id, 'joplin', 'tag')):
+            with metrics.stage('tagging'):
+                apply_tag_to_note(account.api_url, account.api_token, tag_id, note_id)
+            if ledger:
+                ledger.record(note_id, 'joplin', 'tag', url)
+
+        with metrics.stage('publishing'):
+            futures = {}
+            errors = {}
+            for destination in destinations:
+                if ledger and ledger.done(note_id, destination.name, 'push'):
+                    print (f"already in {destination.name}, skip push:\t{note_title}")
+                    result['published'][destination.name] = True
+                    continue
+                if not destination.breaker.allow():
+                    errors[destination.name] = CircuitOpenError(f"circuit open for {destination.name}")
+                    continue
+                futures[destination.name] = (destination.breaker,
+                                             destination.pool.submit(destination.publish, url, note))
+
+            for name, (breaker, future) in futures.items():
+                try:
+                    ok = future.result()
+                except requests.RequestException as e:
+                    breaker.record_failure()
+                    errors[name] = e
+                    continue
+                if ok:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                result['published'][name] = ok
+                if ledger:
+                    ledger.record(note_id, name, 'push', url, 'done' if ok else 'failed')
+                if ok:
+                    print (f"add url to {name}:\t{note_title}")
+                else:
+                    print (f"add url to {name} fail:\t {note_title}")
+
+        if errors:
+            # 暫時性錯誤（網路、429、5xx）：已成功的目的地記在 ledger，筆記留在 INBOX 下次再試
+            result['error'] = '; '.join(f"{name}: {e}" for name, e in errors.items())
+            result['deferred'] = any(isinstance(e, CircuitOpenError) for e in errors.values())
+            print (f"🚫 暫時無法發佈，留在 INBOX:\t {note_title} ({result['error']})")
+            return result
+
+        success = all(result['published'].values())
+        target = dest_nb_id if success else fail_nb_id
+        if target is None or target == note.get('parent_id'):
+            # backfill：成功的筆記留在原 notebook
+            result['moved'] = True
         else:
-            print (f"add url fail:\t {note_title}")
-            if move_note_to_notebook(API_URL, API_TOKEN, note_id, fail_nb_id):
-                print (f"move to notebook fail:\t {note_title}")
-        
-
-def pub2readeck(session_id, items, dest_nb_id, fail_nb_id):
-    for note in items:
-        note_id = note['id']
-        note_title = note['title']
-
-        tag_id = ensure_yearmonth_tag(API_URL, API_TOKEN)
-        apply_tag_to_note(API_URL, API_TOKEN, tag_id, note_id)
-
-        if add_to_readeck(f"{NOTES_URL}{NOTES_URL_PREFIX}/n/{note_id}", title = note_title):
-            print (f"add url to readeck:\t{note_title}")
-            if move_note_to_notebook(API_URL, API_TOKEN, note_id, dest_nb_id):
-                print (f"move to notebook {str_year}:\t {note_title}")
+            with metrics.stage('moving'):
+                result['moved'] = move_note_to_notebook(account.api_url, account.api_token, note_id, target)
+
+        if result['moved']:
+            if ledger:
+                ledger.record(note_id, 'joplin', 'move', url, 'done' if success else 'failed')
+            if target in (None, note.get('parent_id')):
+                print (f"keep in notebook:\t {note_title}")
+            else:
+                print (f"move to notebook {datetime.now().strftime('%Y') if success else 'fail'}:\t {note_title}")
+    except requests.RequestException as e:
+        # 留在 INBOX，下次執行再處理
+        result['error'] = str(e)
+        print (f"🚫 處理失敗:\t {note_title} ({e})")
+
+    return result
+
+
+class RunDeadline:
+    """
+    單次執行的時間預算。
+
+    以 EWMA 估計每篇筆記的處理時間，預估「目前排隊中的筆記 + 下一篇」處理完的時間
+    超過 budget - margin 時 allows() 回傳 False；已派出的筆記仍會完成 move。
+
+    Args:
+        budget (float): 預算秒數，0 為不限制
+        margin (float): 預留給收尾（寫入狀態、metrics）的秒數
+    """
+
+    def __init__(self, budget: float = RUN_DEADLINE, margin: float = RUN_DEADLINE_MARGIN):
+        self.budget = budget
+        self.margin = margin
+        self.started = time.monotonic()
+        self.note_seconds: Optional[float] = None
+        self.stopped = False
+        self.next_note: Optional[Dict] = None
+        self.lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def expired(self) -> bool:
+        return self.budget > 0 and self.elapsed() >= self.budget - self.margin
+
+    def observe(self, seconds: float):
+        with self.lock:
+            self.note_seconds = seconds if self.note_seconds is None else 0.8 * self.note_seconds + 0.2 * seconds
+
+    def allows(self, in_flight: int, workers: int) -> bool:
+        if self.budget <= 0:
+            return True
+        with self.lock:
+            per_note = self.note_seconds or 0.0
+        rounds = -(-(in_flight + 1) // max(workers, 1))
+        return self.elapsed() + per_note * rounds <= self.budget - self.margin
+
+    def stop(self, note: Dict):
+        """記錄停在哪一篇筆記（第一篇沒有派出的筆記）。"""
+        if not self.stopped:
+            self.stopped = True
+            self.next_note = note
+
+
+def save_checkpoint(deadline: RunDeadline, processed: int, account: Account = DEFAULT_ACCOUNT):
+    """依本次是否因時間預算提前停止，寫入或清除 checkpoint。"""
+    note = deadline.next_note or {}
+    try:
+        store = get_store()
+        if not deadline.stopped:
+            store.delete(account.key(CHECKPOINT_KEY))
+            return
+        store.set(account.key(CHECKPOINT_KEY), {
+            'stopped_at': time.time(),
+            'elapsed': round(deadline.elapsed(), 3),
+            'processed': processed,
+            'next_note_id': note.get('id'),
+            'next_created_time': note.get('created_time'),
+        })
+    except (OSError, sqlite3.Error) as e:
+        print (f"⚠️ 無法寫入 checkpoint: {e}")
+        return
+    print (f"⏱️ [{account.name}] time budget reached after {processed} notes, "
+           f"next run resumes at {note.get('title')}")
+
+
+def load_checkpoint(account: Account = DEFAULT_ACCOUNT) -> Optional[Dict]:
+    try:
+        return get_store().get(account.key(CHECKPOINT_KEY))
+    except (OSError, sqlite3.Error):
+        return None
+
+
+def timed_publish_one(deadline: Optional[RunDeadline], *args) -> Dict:
+    start = time.monotonic()
+    try:
+        return publish_one(*args)
+    finally:
+        if deadline:
+            deadline.observe(time.monotonic() - start)
+
+
+def publish_notes(items, destinations, dest_nb_id, fail_nb_id, concurrency=1,
+                  deadline: Optional[RunDeadline] = None, account: Account = DEFAULT_ACCOUNT,
+                  leases: Optional[ShardLeases] = None, listed_at: Optional[float] = None) -> List[Dict]:
+    """
+    以有上限的 worker pool 平行處理筆記，每篇筆記只走訪一次（tag → 推送到所有目的地 → move）。
+
+    items 可以是 generator：同時排隊的筆記數有上限，下載與發佈會互相重疊。
+
+    Args:
+        items (Iterable[Dict]): 要發佈的筆記
+        destinations (List[Destination]): 發佈目的地
+        dest_nb_id (str): 成功時移入的 notebook ID
+        fail_nb_id (str): 失敗時移入的 notebook ID
+        concurrency (int): 同時處理的筆記數上限
+        deadline (RunDeadline, optional): 時間預算；預估超過時停止派工並記下停在哪一篇
+        account (Account): 筆記所屬的帳號
+        leases (ShardLeases, optional): 分片模式下只派出本 worker 持有分片的筆記，並登記為處理中
+            直到完成，lease 在此之前不會被釋出給其他 worker
+        listed_at (float, optional): 開始列出 items 的 time.monotonic()，預設為呼叫時（items 為 generator）；
+            之後才接手的分片，列出的筆記可能已被原本的 worker 處理完，留到下一輪
+
+    Returns:
+        List[Dict]: 已處理筆記的結果，順序與 items 相同
+    """
+    listed_at = listed_at or time.monotonic()
+    items = iter(items)
+    first = next(items, None)
+    if first is None:
+        return []
+
+    # tag 在派工前只解析一次，避免多個 worker 同時建立重複的 tag
+    tag_id = ensure_yearmonth_tag(account.api_url, account.api_token)
+
+    workers = max(concurrency, 1)
+    futures = []
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for note in itertools.chain([first], items):
+            if len(in_flight) >= workers * 2:
+                _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            if deadline and not deadline.allows(len(in_flight), workers):
+                deadline.stop(note)
+                break
+            # 派工時才檢查，lease 在執行中被收回時不再派出該分片的筆記
+            if leases and not leases.begin(note['id'], listed_at):
+                continue
+            future = pool.submit(timed_publish_one, deadline, note, destinations, tag_id, dest_nb_id, fail_nb_id,
+                                 account)
+            if leases:
+                future.add_done_callback(lambda _, note_id=note['id']: leases.end(note_id))
+            in_flight.add(future)
+            futures.append(future)
+
+    results = [future.result() for future in futures]
+
+    for destination in destinations:
+        published = sum(1 for r in results if r['published'].get(destination.name))
+        failed = sum(1 for r in results if r['published'].get(destination.name) is False)
+        print (f"[{account.name}] {destination.name}: published {published}, failed {failed}")
+        if destination.breaker.opened:
+            print (f"[{account.name}] {destination.name}: circuit opened {destination.breaker.opened} times, "
+                   f"{destination.breaker.state} now")
+    pending = sum(1 for r in results if not r['moved'])
+    print (f"[{account.name}] notes: {len(results)}, left in inbox {pending}")
+    return results
+
+
+def retry_delay(attempts: int) -> float:
+    """第 attempts 次失敗後到下次重試的等待秒數。"""
+    return min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY)
+
+
+def retry_failed_notes(destinations, dest_nb_id, fail_nb_id, budget=RETRY_BUDGET,
+                       deadline: Optional[RunDeadline] = None, account: Account = DEFAULT_ACCOUNT) -> List[Dict]:
+    """
+    重新發佈 fail notebook 中已到重試時間的筆記，成功的移入年度 notebook。
+
+    在 INBOX 處理完後才執行，每次最多 budget 篇，因此不會拖慢 INBOX。第一次看到的筆記
+    排在 RETRY_BASE_DELAY 秒後，之後每次失敗等待時間加倍（上限 RETRY_MAX_DELAY），
+    失敗 RETRY_MAX_ATTEMPTS 次後不再重試；circuit breaker 開路而未處理的不計入次數。
+
+    Args:
+        destinations (List[Destination]): 發佈目的地
+        dest_nb_id (str): 成功時移入的 notebook ID
+        fail_nb_id (str): fail notebook ID
+        budget (int): 本次最多重試的筆記數
+        deadline (RunDeadline, optional): 時間預算；已用完時不重試
+        account (Account): fail notebook 所屬的帳號
+
+    Returns:
+        List[Dict]: 每篇重試筆記的處理結果
+    """
+    queue = get_retry_queue(account)
+    if queue is None or budget <= 0 or not fail_nb_id or (deadline and (deadline.stopped or deadline.expired())):
+        return []
+
+    now = time.time()
+    listed_at = time.monotonic()
+    notes = list(get_filtered_notes(account.api_url, account.api_token, notebook_id=fail_nb_id))
+    queue.prune({note['id'] for note in notes})
+
+    due = []
+    leases = get_leases()
+    for note in notes:
+        if leases and not leases.owns(note['id']):
+            continue
+        entry = queue.get(note['id'])
+        if entry is None:
+            queue.schedule(note['id'], 0, now + retry_delay(0))
+            continue
+        attempts, next_at = entry
+        if attempts < RETRY_MAX_ATTEMPTS and next_at <= now:
+            due.append((next_at, attempts, note))
+    if not due:
+        return []
+
+    due.sort(key=lambda item: item[0])
+    due = due[:budget]
+    attempts = {note['id']: n for _, n, note in due}
+    print (f"[{account.name}] retry {len(due)} notes from fail notebook")
+
+    # 因時間預算沒派出的筆記不會出現在 results，排程不變
+    workers = note_workers(account, [destination.concurrency for destination in destinations])
+    results = publish_notes([note for _, _, note in due], destinations, dest_nb_id, fail_nb_id, workers,
+                            deadline, account, leases, listed_at)
+    for r in results:
+        if r['deferred']:
+            continue
+        if r['moved'] and all(r['published'].values()):
+            queue.remove(r['id'])
         else:
-            print (f"add url fail:\t {note_title}")
-            if move_note_to_notebook(API_URL, API_TOKEN, note_id, fail_nb_id):
-                print (f"move to notebook fail:\t {note_title}")
+            n = attempts[r['id']] + 1
+            queue.schedule(r['id'], n, time.time() + retry_delay(n), r['error'])
+    get_metrics().count('retried', len(results))
+    return results
 
 
-if __name__ == "__main__":
-    session_id = get_session(USER, PASS)
-    if session_id is None:
-        print ('can\'t get session id')
-        sys.exit()
-    print (f"get session id  {session_id}")
+def cleanup_shares(session_id, tag_id, concurrency=4, account: Account = DEFAULT_ACCOUNT) -> int:
+    """
+    刪除帶有指定 tag 的筆記所建立的 share。
+
+    先以 /tags/{id}/notes 取得該 tag 下所有筆記 ID，再與 share 清單在記憶體中比對，
+    不需要對每個 share 查詢一次筆記的 tag。
+
+    Args:
+        session_id (str): Joplin Server session ID
+        tag_id (str): 舊月份 tag ID
+        concurrency (int): 同時刪除的 share 數上限
+        account (Account): share 所屬的帳號
+
+    Returns:
+        int: 成功刪除的 share 數
+    """
+    shares = get_shares(session_id, account.server_url)
+    if not shares:
+        return 0
+
+    note_ids = {note['id'] for note in get_filtered_notes(account.api_url, account.api_token, tag_id=tag_id,
+                                                          fields='id')}
+    leases = get_leases()
+    targets = [item for item in shares
+               if item['note_id'] in note_ids and (leases is None or leases.owns(item['note_id']))]
+
+    removed = 0
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        for item, ok in zip(targets, pool.map(lambda item: del_share(session_id, item, account.server_url), targets)):
+            if ok:
+                removed += 1
+                print (f"remove sahre:\t {item['id']}")
+
+    return removed
 
-    CREATED_AFTER = datetime.now() - timedelta(days=2048)
 
-    fail_nb_id = get_notebook_id_by_name(API_URL, API_TOKEN, 'fail')
-    nb_id = get_notebook_id_by_name(API_URL, API_TOKEN, INBOX)
+def inbox_window(account: Account, mode: str, sharded: bool = False) -> datetime:
+    """
+    INBOX 掃描的起點：上次因時間預算提前停止時，完整掃描從停下的那篇筆記繼續
+    （分片模式下各 worker 的分片會變動，不使用 checkpoint）。
+    """
+    created_after = datetime.now() - timedelta(days=INBOX_WINDOW_DAYS)
+    checkpoint = load_checkpoint(account) if mode == 'full' and not sharded else None
+    if checkpoint and checkpoint.get('next_created_time'):
+        resume = datetime.fromtimestamp((checkpoint['next_created_time'] - 1) / 1000)
+        created_after = max(created_after, resume)
+        print (f"[{account.name}] resume from checkpoint at {resume}")
+    return created_after
+
+
+def sync_account(account: Account, session_id: str, mode: str = SYNC_MODE, cleanup: bool = True) -> Dict:
+    """
+    同步單一帳號：列出 INBOX、發佈、移動、重試 fail notebook，並（可選）清除舊月份的 share。
+
+    Args:
+        account (Account): 要同步的帳號
+        session_id (str): 此帳號的 Joplin Server session ID
+        mode (str): full 或 incremental
+        cleanup (bool): 是否清除舊月份 tag 的 share
+        keep_leases (bool): 結束後繼續在背景續約 lease（daemon 在輪與輪之間保留分片）
+
+    Returns:
+        Dict: {'notes', 'pending'}，本帳號處理的筆記數與仍留在 INBOX 的筆記數
+    """
+    api_url, token = account.api_url, account.api_token
+    deadline = RunDeadline()
+    leases = get_leases()
+    if leases and mode == 'incremental':
+        # cursor 與 pending 無法在 worker 之間分片，分片模式一律完整掃描
+        mode = 'full'
+    CREATED_AFTER = inbox_window(account, mode, sharded=bool(leases))
+
+    fail_nb_id = get_notebook_id_by_name(api_url, token, 'fail')
+    nb_id = get_notebook_id_by_name(api_url, token, account.inbox)
     str_year = datetime.now().strftime('%Y')
-    dest_nb_id = get_notebook_id_by_name(API_URL, API_TOKEN, str_year)
+    dest_nb_id = get_notebook_id_by_name(api_url, token, str_year)
+
+    items, cursor = get_inbox_notes(api_url, token, nb_id, CREATED_AFTER, mode, account)
+
+    verifier = get_verifier(account)
+    destinations = get_destinations(account, verifier)
+    results = []
+    if destinations:
+        try:
+            workers = note_workers(account, [destination.concurrency for destination in destinations])
+            results = publish_notes(items, destinations, dest_nb_id, fail_nb_id, workers, deadline,
+                                    account, leases)
+            if mode == 'incremental':
+                pending = [r['id'] for r in results if not r['moved']]
+                if deadline.stopped:
+                    if isinstance(items, list):
+                        # 沒派出的筆記加入 pending，下次執行從這裡繼續
+                        done = {r['id'] for r in results}
+                        pending += [note['id'] for note in items if note['id'] not in done]
+                    else:
+                        # 完整掃描中途停止：不保存 cursor，下次重新掃描
+                        cursor = None
+                save_sync_state(cursor, pending, account)
+            if not leases:
+                save_checkpoint(deadline, len(results), account)
+            if verifier:
+                wait = READECK_VERIFY_WAIT
+                if deadline.budget > 0:
+                    wait = min(wait, deadline.budget - deadline.margin - deadline.elapsed())
+                verifier.verify(fail_nb_id, wait)
+            # fail notebook 的重試排在 INBOX 之後，且有每次執行的上限
+            retry_failed_notes(destinations, dest_nb_id, fail_nb_id, deadline=deadline, account=account)
+        finally:
+            for destination in destinations:
+                destination.close()
+
+    if cleanup and not deadline.expired():
+        older_tag = (datetime.now() - timedelta(days = 100)).strftime("%Y%m")
+        print (f"[{account.name}] Delete older tag {older_tag} share")
+        tag_id = get_tag_id_by_name(api_url, token, older_tag)
+
+        if tag_id:
+            with get_metrics().stage('cleanup'):
+                cleanup_shares(session_id, tag_id, SHARE_CLEANUP_CONCURRENCY, account)
+
+    get_metrics().count(f"notes:{account.name}", len(results))
+    return {'notes': len(results), 'pending': sum(1 for r in results if not r['moved'])}
+
+
+def hold_leases(leases: ShardLeases) -> bool:
+    """
+    登記本 worker、等其他同時啟動的 worker 出現後認領分片，並開始每 LEASE_RENEW_INTERVAL 秒
+    在背景續約（新 worker 加入時釋出多的分片）。已在續約時不做事；回傳是否由此次呼叫開始續約。
+    """
+    if leases.renewing:
+        return False
+    leases.join()
+    time.sleep(LEASE_SETTLE)
+    leases.claim()
+    leases.start_renewal(LEASE_RENEW_INTERVAL)
+    return True
+
+
+def sync_once(sessions: Dict[str, str], accounts: List[Account], mode: str = SYNC_MODE,
+              cleanup: bool = True, keep_leases: bool = False) -> Dict:
+    """
+    同步所有帳號一次並寫出 metrics。
+
+    各帳號在自己的 thread 中同時執行、各自有 note_workers() 個 worker，筆記多的帳號
+    不會佔用其他帳號的 worker；對同一個上游（例如同一台 Readeck）的請求共用連線池與並行上限。
+    單一帳號失敗不影響其他帳號。分片模式下只處理本 worker 持有 lease 的分片中的筆記。
+
+    Args:
+        sessions (Dict[str, str]): 帳號名稱 → Joplin Server session ID
+        accounts (List[Account]): 要同步的帳號
+        mode (str): full 或 incremental
+        cleanup (bool): 是否清除舊月份 tag 的 share
+        keep_leases (bool): 結束後繼續在背景續約 lease（daemon 在輪與輪之間保留分片）
+
+    Returns:
+        Dict: 本次執行的 metrics summary，另含 pending（仍留在 INBOX 的筆記數）與 errors（失敗的帳號）
+    """
+    start_run()
+    pending = 0
+    errors = {}
+    leases = get_leases()
+    renewing = False
+    if leases:
+        renewing = hold_leases(leases)
+        print (f"worker {leases.worker_id}: shards {sorted(leases.owned)} of {leases.shards}")
 
-    items = get_filtered_notes(API_URL, API_TOKEN, CREATED_AFTER, None, nb_id)
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(accounts), 1)) as pool:
+            futures = {account.name: pool.submit(sync_account, account, sessions[account.name], mode, cleanup)
+                       for account in accounts if sessions.get(account.name)}
+            for name, future in futures.items():
+                try:
+                    pending += future.result()['pending']
+                except (requests.RequestException, sqlite3.Error, OSError) as e:
+                    errors[name] = str(e)
+                    print (f"🚫 [{name}] sync failed: {e}")
+    finally:
+        if renewing and not keep_leases:
+            leases.stop_renewal()
+
+    print_connection_report()
+    get_metrics().finish()
+    summary = get_metrics().summary()
+    summary['pending'] = pending
+    summary['errors'] = errors
+    print_report(summary)
+    write_report(summary)
+    return summary
+
+
+def backfill_key(account: Account, notebook: Optional[str], since: datetime, until: Optional[datetime]) -> str:
+    """此帳號、notebook 與日期範圍的 backfill 進度在 state store 中的 key。"""
+    return account.key(f"{BACKFILL_KEY}:{notebook or '*'}:{since:%Y%m%d}:{f'{until:%Y%m%d}' if until else '*'}")
+
+
+def warn_proxy_whitelist(account: Account, folders: Dict[str, str]):
+    """
+    joplin-proxy 設定 ALLOWED_FOLDER_IDS 時，其他 notebook 的筆記公開網址回傳 403，Readeck 會存下錯誤頁
+    或被 verifier 移到 fail。補發佈的 notebook 不在 PROXY_ALLOWED_FOLDER_IDS 中時提出警告；
+    未設定 PROXY_ALLOWED_FOLDER_IDS 時無法確認，列出需要加入白名單的 notebook ID。
 
-    if READECK_TOKEN is not None: 
-        pub2readeck(session_id, items, dest_nb_id, fail_nb_id)
+    Args:
+        account (Account): 要補發佈的帳號
+        folders (Dict[str, str]): 要補發佈的 notebook 名稱 → ID
+    """
+    blocked = {name: folder_id for name, folder_id in folders.items() if folder_id not in PROXY_ALLOWED_FOLDER_IDS}
+    if not blocked:
+        return
+    listed = ', '.join(f"{name} ({folder_id})" for name, folder_id in sorted(blocked.items()))
+    if PROXY_ALLOWED_FOLDER_IDS:
+        print (f"⚠️ [{account.name}] notebook 不在 joplin-proxy 的 ALLOWED_FOLDER_IDS 中，公開網址會回傳 403: {listed}")
     else:
-        print ("Do not publish to readeck")
+        print (f"⚠️ [{account.name}] 未設定 PROXY_ALLOWED_FOLDER_IDS，無法確認；"
+               f"joplin-proxy 有設定 ALLOWED_FOLDER_IDS 時需加入: {listed}")
+
+
+def backfill_account(account: Account, notebook: Optional[str], since: datetime, until: Optional[datetime],
+                     chunk_days: int = BACKFILL_CHUNK_DAYS, workers: int = BACKFILL_WORKERS,
+                     restart: bool = False) -> Dict:
+    """
+    依 created_time 分段補發佈 notebook（未指定時為 INBOX 與 fail 以外的所有筆記）中在 since ~ until 建立的筆記。
+
+    每段最多 workers 篇筆記同時處理，整段完成後把進度存到 state store，中斷後從未完成的那一段繼續；
+    ledger 中所有目的地都已推送成功的筆記不再處理。成功的筆記留在原 notebook（來源為 INBOX 時
+    與 sync 相同移到年度 notebook），失敗的移到 fail，由 fail notebook 的重試處理。
+    有筆記因暫時性錯誤或 circuit breaker 開路而沒處理完時停在該段，下次執行重做此段。
+
+    Args:
+        account (Account): 要補發佈的帳號
+        notebook (str, optional): notebook 名稱
+        since (datetime): 起始建立時間
+        until (datetime, optional): 結束建立時間（不含），None 為不限制
+        chunk_days (int): 每段涵蓋的天數
+        workers (int): 同時處理的筆記數
+        restart (bool): 忽略已保存的進度，從 since 重新開始
+
+    Returns:
+        Dict: {'notes', 'chunks', 'done'}，本次處理的筆記數、完成的段數與是否已處理完整個範圍
+
+    Raises:
+        ValueError: 指定的 notebook 不存在
+    """
+    api_url, token = account.api_url, account.api_token
+    store = get_store()
+    key = backfill_key(account, notebook, since, until)
+    progress = {} if restart else (store.get(key) or {})
+    if progress.get('done'):
+        print (f"[{account.name}] backfill already done ({progress['notes']} notes)")
+        return {'notes': 0, 'chunks': 0, 'done': True}
+
+    notebook_id = None
+    if notebook:
+        notebook_id = get_index(api_url, token).folder_id(notebook)
+        if notebook_id is None:
+            raise ValueError(f"notebook {notebook} not found")
+    fail_nb_id = get_notebook_id_by_name(api_url, token, 'fail')
+    dest_nb_id = None
+    if notebook == account.inbox:
+        dest_nb_id = get_notebook_id_by_name(api_url, token, datetime.now().strftime('%Y'))
+
+    origin = int(since.timestamp() * 1000)
+    chunk_ms = max(chunk_days, 1) * 86400 * 1000
+    next_created_time = max(progress.get('next_created_time', origin), origin)
+    if next_created_time > origin:
+        print (f"[{account.name}] backfill resume from {datetime.fromtimestamp(next_created_time / 1000)}")
+    # 來源為 INBOX 時成功的筆記會被移出，需要重掃；其他 notebook 的筆記留在原處
+    items = get_filtered_notes(api_url, token, datetime.fromtimestamp((next_created_time - 1) / 1000), until,
+                               notebook_id, rescan=dest_nb_id is not None)
+
+    ledger = get_ledger()
+    verifier = get_verifier(account)
+    destinations = get_destinations(account, verifier)
+    if not destinations:
+        return {'notes': 0, 'chunks': 0, 'done': False}
+
+    # 未指定 notebook 時略過 INBOX（由 sync 處理並移到年度 notebook）與 fail（由重試處理）
+    skipped = {fail_nb_id}
+    if notebook is None:
+        skipped.add(get_index(api_url, token).folder_id(account.inbox))
+        warn_proxy_whitelist(account, {name: folder_id for name, folder_id in get_index(api_url, token).folders().items()
+                                       if folder_id not in skipped})
+    elif dest_nb_id is None:
+        warn_proxy_whitelist(account, {notebook: notebook_id})
+
+    def pending(note):
+        if note.get('parent_id') in skipped:
+            return False
+        return dest_nb_id is not None or not (
+            ledger and all(ledger.done(note['id'], d.name, 'push') for d in destinations))
+
+    notes = chunks = 0
+    done = True
+    try:
+        for n, group in itertools.groupby(items, key=lambda note: (note['created_time'] - origin) // chunk_ms):
+            chunk_end = origin + (n + 1) * chunk_ms
+            chunk = [note for note in group if pending(note)]
+            results = publish_notes(chunk, destinations, dest_nb_id, fail_nb_id, workers, None, account)
+            notes += len(results)
+            unfinished = sum(1 for r in results if not r['moved'])
+            if unfinished:
+                print (f"🚫 [{account.name}] backfill: {unfinished} notes unfinished before "
+                       f"{datetime.fromtimestamp(chunk_end / 1000):%Y-%m-%d}, resume from this chunk next time")
+                done = False
+                break
+
+            chunks += 1
+            # INBOX 的重新掃描會回到較早的段，進度只前進不後退
+            next_created_time = max(next_created_time, chunk_end)
+            progress = {'next_created_time': next_created_time, 'notes': progress.get('notes', 0) + len(results)}
+            store.set(key, progress)
+            print (f"[{account.name}] backfill: chunk before {datetime.fromtimestamp(chunk_end / 1000):%Y-%m-%d} "
+                   f"done, {progress['notes']} notes so far")
+
+        if done:
+            store.set(key, dict(progress, done=True))
+        if verifier:
+            verifier.verify(fail_nb_id)
+    finally:
+        for destination in destinations:
+            destination.close()
+
+    return {'notes': notes, 'chunks': chunks, 'done': done}
+
+
+def plan_account(account: Account, session_id: Optional[str], mode: str = SYNC_MODE) -> Dict:
+    """
+    以唯讀方式執行一次同步的列出與查詢階段，估算其餘階段會發出的請求數。
 
-    pub2instapaper(session_id, items, dest_nb_id, fail_nb_id)
+    不建立 tag / notebook、不推送、不移動筆記，也不更新 cursor、checkpoint 與重試排程；
+    ledger 中已完成的步驟與 Readeck 已有的書籤不計入。列出與查詢本身的請求由 metrics 量測。
 
-    older_tag = (datetime.now() - timedelta(days = 100)).strftime("%Y%m")
-    print (f"Delete older tag {older_tag} share")
-    tag_id = get_tag_id_by_name(API_URL, API_TOKEN, older_tag)
+    Args:
+        account (Account): 要估算的帳號
+        session_id (str, optional): Joplin Server session ID；None 時不估算 share 清除
+        mode (str): full 或 incremental
+
+    Returns:
+        Dict: {'notes', 'retries', 'shares', 'rows', 'workers'}，rows 為各階段預計的請求
+        （stage, upstream, endpoint, requests, parallel），workers 為同時處理的筆記數
+    """
+    api_url, token = account.api_url, account.api_token
+    index = get_index(api_url, token)
+    rows = []
+
+    def add(stage, upstream, method, url, count, parallel=1):
+        if count <= 0:
+            return
+        endpoint = endpoint_name(method, url)
+        for row in rows:
+            if (row['stage'], row['upstream'], row['endpoint']) == (stage, upstream, endpoint):
+                row['requests'] += count
+                return
+        rows.append({'stage': stage, 'upstream': upstream, 'endpoint': endpoint, 'requests': count,
+                     'parallel': max(parallel, 1)})
+
+    for name in ('fail', account.inbox, datetime.now().strftime('%Y')):
+        if index.folder_id(name) is None:
+            add('setup', 'joplin', 'POST', f"{api_url}/folders", 1)
+
+    nb_id = index.folder_id(account.inbox)
+    notes = []
+    if nb_id:
+        items, _ = get_inbox_notes(api_url, token, nb_id, inbox_window(account, mode), mode, account, rescan=False)
+        notes = list(items)
+    if notes and index.tag_id(datetime.now().strftime("%Y%m")) is None:
+        add('setup', 'joplin', 'POST', f"{api_url}/tags", 1)
+
+    targets = {}
+    if account.readeck_token is not None:
+        url = f"{account.readeck_url}/api/bookmarks"
+        targets['readeck'] = (url, pool_size(READECK_CONCURRENCY, get_upstream("readeck", url)))
+    if account.instapaper_username and account.instapaper_password:
+        url = f"{INSTAPAPER_URL}/api/add"
+        targets['instapaper'] = (url, pool_size(INSTAPAPER_CONCURRENCY, get_upstream("instapaper", url)))
+    workers = note_workers(account, [concurrency for _, concurrency in targets.values()])
+
+    dedupe = None
+    if notes and READECK_DEDUPE and 'readeck' in targets:
+        dedupe = ReadeckDedupe(f"{account.notes_url}{account.notes_url_prefix}", account.readeck_url,
+                                 account.readeck_token)
+    ledger = get_ledger()
+
+    def plan_notes(stage, notes):
+        tags = moves = 0
+        pushes = dict.fromkeys(targets, 0)
+        for note in notes:
+            # 上一輪已移出的筆記回到 INBOX 時 ledger 會重設，所有步驟重做
+            previous = ledger and not ledger.done(note['id'], 'joplin', 'move')
+            if not (previous and ledger.done(note['id'], 'joplin', 'tag')):
+                tags += 1
+            for name in targets:
+                if previous and ledger.done(note['id'], name, 'push'):
+                    continue
+                if name == 'readeck' and dedupe and dedupe.exists(account.note_url(note['id'])):
+                    continue
+                pushes[name] += 1
+            moves += 1
+        add(stage, 'joplin', 'POST', f"{api_url}/tags/{PLAN_ID}/notes", tags, workers)
+        for name, (url, concurrency) in targets.items():
+            add(stage, name, 'POST', url, pushes[name], min(concurrency, workers))
+        add(stage, 'joplin', 'PUT', f"{api_url}/notes/{PLAN_ID}", moves, workers)
+        return pushes.get('readeck', 0)
+
+    bookmarks = plan_notes('inbox', notes)
+
+    # fail notebook 中已到重試時間的筆記；第一次看到的筆記要等 RETRY_BASE_DELAY 後才重試
+    due = []
+    fail_nb_id = index.folder_id('fail')
+    queue = get_retry_queue(account)
+    if fail_nb_id and queue and RETRY_BUDGET > 0:
+        now = time.time()
+        for note in get_filtered_notes(api_url, token, notebook_id=fail_nb_id):
+            entry = queue.get(note['id'])
+            if entry and entry[0] < RETRY_MAX_ATTEMPTS and entry[1] <= now:
+                due.append(note)
+        due = due[:RETRY_BUDGET]
+    bookmarks += plan_notes('retry', due)
+
+    if bookmarks:
+        tag_count = sum(1 for name in index.tags() if not is_yearmonth_tag(name))
+        add('labels', 'joplin', 'GET', f"{api_url}/tags/{PLAN_ID}/notes", tag_count,
+            pool_size(SYNC_CONCURRENCY, get_upstream("joplin", api_url)))
+    if READECK_VERIFY and 'readeck' in targets:
+        try:
+            bookmarks += len(PendingBookmarks(get_store(), account.namespace).list())
+        except (OSError, sqlite3.Error):
+            pass
+        add('verify', 'readeck', 'GET', f"{account.readeck_url}/api/bookmarks",
+            -(-bookmarks // max(READECK_VERIFY_BATCH, 1)))
+
+    shares = 0
+    if session_id:
+        older_tag = (datetime.now() - timedelta(days = 100)).strftime("%Y%m")
+        tag_id = index.tag_id(older_tag)
+        items = get_shares(session_id, account.server_url) if tag_id else None
+        if items:
+            note_ids = {note['id'] for note in get_filtered_notes(api_url, token, tag_id=tag_id, fields='id')}
+            shares = sum(1 for item in items if item['note_id'] in note_ids)
+        add('cleanup', 'joplin_server', 'DELETE', f"{account.server_url}/api/shares/{PLAN_ID}", shares,
+            SHARE_CLEANUP_CONCURRENCY)
+
+    return {'notes': len(notes), 'retries': len(due), 'shares': shares, 'rows': rows, 'workers': workers}
+
+
+def plan_latencies(*summaries: Optional[Dict]) -> Dict[tuple, float]:
+    """由 metrics summary 取得 (upstream, endpoint) → p50；後面的 summary 優先。"""
+    latencies = {}
+    for summary in summaries:
+        for e in (summary or {}).get('endpoints', []):
+            latencies[(e['upstream'], e['endpoint'])] = e['p50']
+    return latencies
+
+
+def estimate_plan(plan: Dict, latencies: Dict[tuple, float], concurrency: int) -> float:
+    """
+    在 rows 中填入 p50 與預估秒數，回傳各階段的預估時間總和（不含已量測的查詢時間）。
+
+    沒有量測值的 endpoint 使用同一上游其他 endpoint 的 p50 中位數，再沒有時使用 PLAN_DEFAULT_LATENCY。
+    inbox / retry 階段的 tag、推送、移動共用 concurrency 個 worker，且各目的地不超過自己的並行上限。
+    """
+    by_upstream: Dict[str, List[float]] = {}
+    for (upstream, _), p50 in latencies.items():
+        by_upstream.setdefault(upstream, []).append(p50)
+
+    stages: Dict[str, List[Dict]] = {}
+    for row in plan['rows']:
+        p50 = latencies.get((row['upstream'], row['endpoint']))
+        row['measured'] = p50 is not None
+        if p50 is None:
+            known = sorted(by_upstream.get(row['upstream'], []))
+            p50 = known[len(known) // 2] if known else PLAN_DEFAULT_LATENCY
+        row['p50'] = p50
+        row['seconds'] = row['requests'] * p50 / row['parallel']
+        stages.setdefault(row['stage'], []).append(row)
+
+    total = 0.0
+    for stage, rows in stages.items():
+        workers = max(concurrency, 1) if stage in ('inbox', 'retry') else max(row['parallel'] for row in rows)
+        work = sum(row['requests'] * row['p50'] for row in rows)
+        total += max(work / workers, max(row['seconds'] for row in rows))
+    return total
+
+
+def print_plan(account: Account, plan: Dict):
+    print (f"[{account.name}] plan: {plan['notes']} notes in inbox, {plan['retries']} retries due, "
+           f"{plan['shares']} shares to delete")
+    print (f"  {'stage':<8}{'upstream':<15}{'endpoint':<32}{'requests':>9}{'p50':>9}{'est.':>10}")
+    for row in plan['lookups'] + plan['rows']:
+        p50 = f"{row['p50']:.3f}" + ('' if row.get('measured', True) else '*')
+        print (f"  {row['stage']:<8}{row['upstream']:<15}{row['endpoint']:<32}{row['requests']:>9}"
+               f"{p50:>9}{row['seconds']:>9.1f}s")
+
+    totals: Dict[str, int] = {}
+    for row in plan['lookups'] + plan['rows']:
+        totals[row['upstream']] = totals.get(row['upstream'], 0) + row['requests']
+    print (f"  requests: {', '.join(f'{name} {n}' for name, n in totals.items()) or 'none'}")
+    print (f"  estimated {plan['seconds']:.1f}s (lookups {plan['lookup_seconds']:.1f}s measured, "
+           f"concurrency {plan['workers']}); * = p50 not measured")
+
+    if RUN_DEADLINE > 0 and plan['seconds'] > RUN_DEADLINE - RUN_DEADLINE_MARGIN and plan['notes']:
+        per_note = (plan['seconds'] - plan['lookup_seconds']) / plan['notes']
+        fits = max(int((RUN_DEADLINE - RUN_DEADLINE_MARGIN - plan['lookup_seconds']) / per_note), 0) if per_note else 0
+        print (f"  ⚠️ exceeds RUN_DEADLINE {RUN_DEADLINE:.0f}s, about {fits} notes per run")
+
+
+def run_plan(accounts: List[Account], sessions: Dict[str, str], mode: str = SYNC_MODE) -> List[Dict]:
+    """
+    逐一估算每個帳號一次同步的請求數與時間。
+
+    寫入類請求的延遲取自上次執行寫出的 metrics（METRICS_DIR），列出與查詢的請求在本次實際執行並量測；
+    本命令不寫出 metrics，避免覆蓋上次執行的統計。
+    """
+    previous = load_report()
+    if previous is None:
+        print (f"no previous metrics in {METRICS_DIR}, unmeasured endpoints use {PLAN_DEFAULT_LATENCY}s")
+
+    plans = []
+    for account in accounts:
+        start_run()
+        started = time.time()
+        plan = plan_account(account, sessions.get(account.name), mode)
+        plan['lookup_seconds'] = time.time() - started
+        measured = get_metrics().summary()
+        plan['lookups'] = [{'stage': 'lookup', 'upstream': e['upstream'], 'endpoint': e['endpoint'],
+                            'requests': e['requests'], 'parallel': 1, 'p50': e['p50'],
+                            'seconds': e['requests'] * e['p50']} for e in measured['endpoints']]
+        plan['seconds'] = plan['lookup_seconds'] + estimate_plan(plan, plan_latencies(previous, measured),
+                                                                 plan['workers'])
+        plan['account'] = account.name
+        print_plan(account, plan)
+        plans.append(plan)
+    return plans
+
+
+class DaemonStatus:
+    """常駐模式的狀態，供 /healthz 使用。"""
+
+    def __init__(self, stale_after: float):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stale_after = stale_after
+        self.last_cycle: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.cycles = 0
+        self.interval = 0.0
+        self.last_notes = 0
+
+    def record(self, notes: int = 0, error: Optional[str] = None, interval: float = 0.0):
+        with self.lock:
+            self.last_cycle = time.time()
+            self.cycles += 1
+            self.last_notes = notes
+            self.last_error = error
+            self.interval = interval
+
+    def snapshot(self) -> Tuple[bool, Dict]:
+        with self.lock:
+            reference = self.last_cycle or self.started
+            healthy = time.time() - reference < self.stale_after
+            return healthy, {
+                'status': 'ok' if healthy else 'stale',
+                'cycles': self.cycles,
+                'last_cycle': self.last_cycle,
+                'last_notes': self.last_notes,
+                'last_error': self.last_error,
+                'interval': self.interval,
+            }
+
+
+def start_health_server(status: DaemonStatus, port: int) -> ThreadingHTTPServer:
+    """在背景 thread 提供 GET /healthz，最後一輪超過 stale_after 未完成時回傳 503。"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip('/') != '/healthz':
+                self.send_error(404)
+                return
+            healthy, body = status.snapshot()
+            data = json.dumps(body).encode()
+            self.send_response(200 if healthy else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def login(accounts: List[Account]) -> Dict[str, str]:
+    """登入每個帳號的 Joplin Server，回傳帳號名稱 → session ID（登入失敗的帳號不在其中）。"""
+    sessions = {}
+    for account in accounts:
+        session_id = get_session(account.user, account.password, account.server_url)
+        if session_id is None:
+            print (f"[{account.name}] can't get session id")
+            continue
+        sessions[account.name] = session_id
+    return sessions
+
+
+def run_daemon(accounts: List[Account], min_interval: float, max_interval: float, health_port: int):
+    """
+    常駐執行同步：連線池、session 與 tag / notebook 索引在各輪之間共用。
 
-    if not tag_id:
+    有筆記要處理時以 min_interval 輪詢，INBOX 為空時間隔加倍直到 max_interval。
+    舊 share 清除每 DAEMON_CLEANUP_INTERVAL 秒做一次；SIGTERM / SIGINT 時在本輪結束後停止。
+    分片模式下 lease 在整個執行期間於背景續約，閒置等待比 LEASE_TTL 長也不會失去分片。
+    """
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+
+    status = DaemonStatus(stale_after=max(max_interval * 3, DAEMON_HEALTH_STALE))
+    start_health_server(status, health_port)
+    print (f"daemon: {len(accounts)} accounts, polling every {min_interval}-{max_interval}s, "
+           f"health on :{health_port}/healthz")
+
+    sessions: Dict[str, str] = {}
+    session_at = 0.0
+    index_at = time.time()
+    cleanup_at = 0.0
+    interval = min_interval
+
+    while not stop.is_set():
+        notes = 0
+        error = None
+        try:
+            now = time.time()
+            if now - session_at > DAEMON_SESSION_TTL:
+                sessions = {}
+                session_at = now
+            missing = [account for account in accounts if account.name not in sessions]
+            if missing:
+                sessions.update(login(missing))
+            if not sessions:
+                raise RuntimeError("can't get session id")
+            if now - index_at > DAEMON_INDEX_TTL:
+                reset_indexes()
+                index_at = now
+
+            cleanup = now - cleanup_at > DAEMON_CLEANUP_INTERVAL
+            summary = sync_once(sessions, accounts, SYNC_MODE, cleanup, keep_leases=True)
+            if cleanup:
+                cleanup_at = now
+            # 失敗的帳號 session 可能過期，下一輪重新登入
+            for name in summary['errors']:
+                sessions.pop(name, None)
+            if summary['errors']:
+                error = '; '.join(f"{name}: {e}" for name, e in summary['errors'].items())
+            notes = summary['notes']
+            # 仍有筆記留在 INBOX（暫時性錯誤）時不視為閒置
+            busy = notes > 0 and summary.get('pending', 0) < notes
+            interval = min_interval if busy else min(interval * 2, max_interval)
+        except Exception as e:
+            # 單輪失敗不結束 daemon；session 可能過期，下一輪重新登入
+            error = str(e)
+            sessions = {}
+            interval = min(interval * 2, max_interval)
+            print (f"🚫 daemon cycle failed: {e}")
+
+        status.record(notes, error, interval)
+        stop.wait(interval)
+
+    leases = get_leases()
+    if leases:
+        leases.release()
+
+
+@click.group(invoke_without_command=True)
+@click.option('--accounts', 'accounts_file', type=click.Path(exists=True, dir_okay=False), default=ACCOUNTS_FILE,
+              help='多帳號設定檔（TOML），預設為 ACCOUNTS_FILE；未指定時使用環境變數中的單一帳號')
+@click.pass_context
+def cli(ctx, accounts_file):
+    """將 Joplin INBOX 的筆記發佈到 Readeck / Instapaper。不帶子命令時執行一次 sync。"""
+    if accounts_file:
+        try:
+            ctx.obj = load_accounts(accounts_file)
+        except (ValueError, OSError) as e:
+            raise click.UsageError(str(e))
+    else:
+        ctx.obj = [DEFAULT_ACCOUNT]
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(sync)
+
+
+@cli.command()
+@click.pass_obj
+def sync(accounts):
+    """執行一次同步（CronJob 使用）。"""
+    reset_indexes()
+    sessions = login(accounts)
+    if not sessions:
+        print ('can\'t get session id')
         sys.exit()
+    print (f"get session id for {', '.join(sessions)}")
 
-    items = get_shares(session_id)
-    for item in items:
-        if (check_tag_on_note(API_URL, API_TOKEN, tag_id, item['note_id'])):
-            if del_share(session_id, item): 
-                print (f"remove sahre:\t {item['id']}")
+    try:
+        summary = sync_once(sessions, accounts)
+    finally:
+        leases = get_leases()
+        if leases:
+            leases.release()
+    if summary['errors'] or len(sessions) < len(accounts):
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--notebook', help='要補發佈的 notebook 名稱，未指定時為 INBOX 與 fail 以外的所有 notebook')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), help='起始建立日期，預設為最早的筆記')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), help='結束建立日期（不含），預設為不限制')
+@click.option('--chunk-days', type=int, default=BACKFILL_CHUNK_DAYS, show_default=True, help='每段涵蓋的天數')
+@click.option('--workers', type=int, default=BACKFILL_WORKERS, show_default=True, help='同時處理的筆記數')
+@click.option('--rate', type=float, default=BACKFILL_RATE, show_default=True,
+              help='每個上游每秒最多的請求數，0 為不限制')
+@click.option('--restart', is_flag=True, help='忽略已保存的進度，從頭開始')
+@click.pass_obj
+def backfill(accounts, notebook, since, until, chunk_days, workers, rate, restart):
+    """依建立時間分段補發佈大量舊筆記，可中斷後繼續。"""
+    reset_indexes()
+    set_rate(rate)
+    since = since or datetime.fromtimestamp(0)
+    start_run()
+
+    failed = False
+    for account in accounts:
+        try:
+            result = backfill_account(account, notebook, since, until, chunk_days, workers, restart)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        except (requests.RequestException, sqlite3.Error, OSError) as e:
+            print (f"🚫 [{account.name}] backfill failed: {e}")
+            failed = True
+            continue
+        print (f"[{account.name}] backfill: {result['notes']} notes in {result['chunks']} chunks"
+               f"{'' if result['done'] else ', not finished'}")
+        failed = failed or not result['done']
+
+    print_connection_report()
+    get_metrics().finish()
+    print_report(get_metrics().summary())
+    if failed:
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--mode', type=click.Choice(['full', 'incremental']), default=SYNC_MODE, show_default=True,
+              help='估算的同步模式')
+@click.option('--json', 'json_path', type=click.Path(dir_okay=False), help='把估算結果寫成 JSON')
+@click.pass_obj
+def plan(accounts, mode, json_path):
+    """估算一次同步會發出的請求數與所需時間，不修改任何資料。"""
+    reset_indexes()
+    sessions = login(accounts)
+    if len(sessions) < len(accounts):
+        print ("⚠️ 部分帳號無法登入 Joplin Server，不估算其 share 清除")
+
+    plans = run_plan(accounts, sessions, mode)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(plans, f, indent=2, ensure_ascii=False)
+
+
+@cli.command()
+@click.option('--min-interval', type=float, default=DAEMON_MIN_INTERVAL, show_default=True,
+              help='INBOX 有筆記時的輪詢間隔（秒）')
+@click.option('--max-interval', type=float, default=DAEMON_MAX_INTERVAL, show_default=True,
+              help='INBOX 閒置時的最長輪詢間隔（秒）')
+@click.option('--health-port', type=int, default=DAEMON_HEALTH_PORT, show_default=True,
+              help='/healthz 的 port')
+@click.pass_obj
+def daemon(accounts, min_interval, max_interval, health_port):
+    """常駐執行，取代每 5 分鐘一次的 CronJob。"""
+    run_daemon(accounts, min_interval, max(max_interval, min_interval), health_port)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,458 @@
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# 執行之間需要保留的狀態都放在同一個 SQLite 檔，CronJob 以 PVC 掛在 /logs
+STATE_DIR = os.getenv("STATE_DIR", "/logs")
+STATE_DB = os.getenv("STATE_DB", os.path.join(STATE_DIR, "note2read.db"))
+
+# 分片模式：筆記依 note ID 的 hash 分成 SHARDS 片，每個 worker 以 lease 認領其中幾片。
+# lease 資料庫必須放在所有 worker 共用的 volume（支援檔案鎖），預設與 STATE_DB 相同
+SHARDS = int(os.getenv("SHARDS", "1"))
+LEASE_DB = os.getenv("LEASE_DB", STATE_DB)
+LEASE_TTL = float(os.getenv("LEASE_TTL", "120"))
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# join 之後等多久再認領分片，讓同時啟動的 worker 都已登記（秒）
+LEASE_SETTLE = float(os.getenv("LEASE_SETTLE", "2"))
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS kv (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        updated_at REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ledger (
+        note_id TEXT NOT NULL,
+        destination TEXT NOT NULL,
+        step TEXT NOT NULL,
+        url TEXT,
+        status TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (note_id, destination, step)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS retries (
+        note_id TEXT PRIMARY KEY,
+        account TEXT NOT NULL DEFAULT '',
+        attempts INTEGER NOT NULL,
+        next_at REAL NOT NULL,
+        last_error TEXT,
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS bookmarks (
+        bookmark_id TEXT PRIMARY KEY,
+        account TEXT NOT NULL,
+        note_id TEXT NOT NULL,
+        url TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS leases (
+        shard INTEGER PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS workers (
+        worker_id TEXT PRIMARY KEY,
+        seen_at REAL NOT NULL
+    )
+    """,
+]
+
+# 既有資料庫缺少的欄位：(table, column, 定義)
+MIGRATIONS = [
+    ("retries", "account", "TEXT NOT NULL DEFAULT ''"),
+]
+
+
+class StateStore:
+    """
+    以 SQLite 保存的本機狀態（events cursor 等）。
+
+    Args:
+        path (str): SQLite 檔案路徑，預設為 STATE_DIR/note2read.db
+        wal (bool): 使用 WAL；多台主機經網路檔案系統共用時需關閉（WAL 依賴共享記憶體）
+    """
+
+    def __init__(self, path: str = STATE_DB, wal: bool = True):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        if wal:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        for table, column, definition in MIGRATIONS:
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self.lock:
+            return self.conn.execute(sql, params)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def get_with_time(self, key: str):
+        """回傳 (value, updated_at)，不存在時回傳 (None, None)。"""
+        row = self.execute("SELECT value, updated_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any):
+        self.execute(
+            "INSERT INTO kv (key, value, updated_at) VALUES (?, ?, strftime('%s', 'now')) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+            (key, json.dumps(value)),
+        )
+
+    def delete(self, key: str):
+        self.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class Ledger:
+    """
+    每篇筆記的處理紀錄，用來讓中斷後的執行從斷點繼續。push 依目的地（readeck、instapaper）
+    分別記錄，tag 與 move 記在 destination='joplin'；move 成功為 done，移到 fail 為 failed。
+
+    以 (note_id, destination, step) 為主鍵，查詢只需一次索引查找。
+    """
+
+    def __init__(self, store: StateStore):
+        self.store = store
+
+    def status(self, note_id: str, destination: str, step: str) -> Optional[str]:
+        row = self.store.execute(
+            "SELECT status FROM ledger WHERE note_id = ? AND destination = ? AND step = ?",
+            (note_id, destination, step),
+        ).fetchone()
+        return row[0] if row else None
+
+    def done(self, note_id: str, destination: str, step: str) -> bool:
+        return self.status(note_id, destination, step) == 'done'
+
+    def record(self, note_id: str, destination: str, step: str, url: Optional[str], status: str = 'done'):
+        self.store.execute(
+            "INSERT INTO ledger (note_id, destination, step, url, status, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(note_id, destination, step) DO UPDATE SET "
+            "url = excluded.url, status = excluded.status, updated_at = excluded.updated_at",
+            (note_id, destination, step, url, status, time.time()),
+        )
+
+    def reset(self, note_id: str, destination: Optional[str] = None):
+        """清除這篇筆記（或其在某目的地）的紀錄，筆記再次出現在 INBOX 時重新開始。"""
+        if destination is None:
+            self.store.execute("DELETE FROM ledger WHERE note_id = ?", (note_id,))
+        else:
+            self.store.execute(
+                "DELETE FROM ledger WHERE note_id = ? AND destination = ?",
+                (note_id, destination),
+            )
+
+
+class RetryQueue:
+    """
+    fail notebook 中筆記的重試排程：每篇筆記的嘗試次數與下次可重試的時間。
+
+    Args:
+        store (StateStore): 狀態資料庫
+        account (str): 帳號 namespace，多帳號時各自 prune
+    """
+
+    def __init__(self, store: StateStore, account: str = ''):
+        self.store = store
+        self.account = account
+
+    def get(self, note_id: str) -> Optional[Tuple[int, float]]:
+        """回傳 (attempts, next_at)，尚未排程時回傳 None。"""
+        row = self.store.execute(
+            "SELECT attempts, next_at FROM retries WHERE note_id = ?", (note_id,)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def schedule(self, note_id: str, attempts: int, next_at: float, error: Optional[str] = None):
+        self.store.execute(
+            "INSERT INTO retries (note_id, account, attempts, next_at, last_error, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(note_id) DO UPDATE SET attempts = excluded.attempts, next_at = excluded.next_at, "
+            "last_error = excluded.last_error, updated_at = excluded.updated_at",
+            (note_id, self.account, attempts, next_at, error, time.time()),
+        )
+
+    def remove(self, note_id: str):
+        self.store.execute("DELETE FROM retries WHERE note_id = ?", (note_id,))
+
+    def prune(self, note_ids: Set[str]) -> int:
+        """刪除已不在 fail notebook 中（手動移走或已成功）的筆記的排程。"""
+        with self.store.lock:
+            stale = [row[0] for row in self.store.execute("SELECT note_id FROM retries WHERE account = ?",
+                                                          (self.account,))
+                     if row[0] not in note_ids]
+            for note_id in stale:
+                self.remove(note_id)
+        return len(stale)
+
+
+class PendingBookmarks:
+    """
+    已送出、但 Readeck 尚未確認擷取成功的書籤。
+
+    Args:
+        store (StateStore): 狀態資料庫
+        account (str): 帳號 namespace
+    """
+
+    def __init__(self, store: StateStore, account: str = ''):
+        self.store = store
+        self.account = account
+
+    def add(self, bookmark_id: str, note_id: str, url: str):
+        self.store.execute(
+            "INSERT OR REPLACE INTO bookmarks (bookmark_id, account, note_id, url, created_at) VALUES (?, ?, ?, ?, ?)",
+            (bookmark_id, self.account, note_id, url, time.time()),
+        )
+
+    def list(self) -> List[Dict[str, Any]]:
+        rows = self.store.execute(
+            "SELECT bookmark_id, note_id, url, created_at FROM bookmarks WHERE account = ? ORDER BY created_at",
+            (self.account,),
+        ).fetchall()
+        return [{'bookmark_id': r[0], 'note_id': r[1], 'url': r[2], 'created_at': r[3]} for r in rows]
+
+    def remove(self, bookmark_id: str):
+        self.store.execute("DELETE FROM bookmarks WHERE bookmark_id = ?", (bookmark_id,))
+
+    def expire(self, before: float) -> int:
+        """放棄追蹤 before 之前送出、仍未完成擷取的書籤。"""
+        return self.store.execute(
+            "DELETE FROM bookmarks WHERE account = ? AND created_at < ?", (self.account, before)
+        ).rowcount
+
+
+def shard_of(note_id: str, shards: int) -> int:
+    """note ID 所屬的分片（crc32，跨行程穩定）。"""
+    return zlib.crc32(note_id.encode()) % shards
+
+
+class ShardLeases:
+    """
+    以 SQLite 保存的分片 lease。
+
+    claim() 在單一 IMMEDIATE transaction 中更新本 worker 的 heartbeat，依目前存活的
+    worker 數算出每個 worker 應持有的分片數（無條件進位），續約已持有的分片、
+    釋出多的、再認領沒有人持有或已過期的分片。worker 當掉時 lease 在 ttl 秒後過期，
+    由其他 worker 接手。
+
+    派工前以 begin() 檢查並登記筆記、處理完以 end() 結束；要釋出的分片若還有已派出
+    未完成的筆記，先停止派新的筆記但繼續續約（draining），等筆記都完成後才釋出，
+    新的 worker 因此不會重複處理仍在本 worker 手上的筆記。接手的分片要等下一次列出筆記
+    才處理（begin() 的 since），接手前列出的筆記可能已被原本的 worker 處理完。
+
+    start_renewal() 在背景 thread 定期 claim()；daemon 在整個執行期間續約，輪詢間隔
+    比 ttl 長時閒置的 worker 也不會從 workers 表中過期。
+
+    Args:
+        store (StateStore): 所有 worker 共用的資料庫
+        worker_id (str): 本 worker 的 ID
+        shards (int): 分片數
+        ttl (float): lease 有效秒數
+    """
+
+    def __init__(self, store: StateStore, worker_id: str = WORKER_ID, shards: int = SHARDS, ttl: float = LEASE_TTL):
+        self.store = store
+        self.worker_id = worker_id
+        self.shards = max(shards, 1)
+        self.ttl = ttl
+        self.owned: Set[int] = set()
+        self.draining: Set[int] = set()
+        self.busy: Dict[int, int] = {}
+        self.busy_lock = threading.Lock()
+        self.acquired: Dict[int, float] = {}  # shard -> 認領時間（time.monotonic()）
+        self.renewal: Optional[threading.Thread] = None
+        self.stop_renew = threading.Event()
+
+    def join(self):
+        """只登記 heartbeat；同時啟動的 worker 先互相看見，再 claim() 才能平均分配。"""
+        self.store.execute(
+            "INSERT INTO workers (worker_id, seen_at) VALUES (?, ?) "
+            "ON CONFLICT(worker_id) DO UPDATE SET seen_at = excluded.seen_at",
+            (self.worker_id, time.time()),
+        )
+
+    def claim(self) -> Set[int]:
+        now = time.time()
+        expires = now + self.ttl
+        with self.store.lock:
+            self.store.execute("BEGIN IMMEDIATE")
+            try:
+                self.store.execute(
+                    "INSERT INTO workers (worker_id, seen_at) VALUES (?, ?) "
+                    "ON CONFLICT(worker_id) DO UPDATE SET seen_at = excluded.seen_at",
+                    (self.worker_id, now),
+                )
+                self.store.execute("DELETE FROM workers WHERE seen_at <= ?", (now - self.ttl,))
+                active = self.store.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+                target = math.ceil(self.shards / max(active, 1))
+
+                held = {}
+                for shard, owner in self.store.execute(
+                        "SELECT shard, owner FROM leases WHERE expires_at > ?", (now,)):
+                    held[shard] = owner
+                mine = sorted(shard for shard, owner in held.items() if owner == self.worker_id)
+                # 優先保留有筆記處理中的分片，多出來但仍在處理中的分片繼續續約到處理完
+                with self.busy_lock:
+                    mine.sort(key=lambda shard: (shard not in self.owned, not self.busy.get(shard), shard))
+                    draining = [shard for shard in mine[target:] if self.busy.get(shard)]
+                for shard in mine[target:]:
+                    if shard not in draining:
+                        self.store.execute("DELETE FROM leases WHERE shard = ? AND owner = ?",
+                                           (shard, self.worker_id))
+                mine = mine[:target]
+                free = [shard for shard in range(self.shards) if shard not in held]
+                mine += free[:max(target - len(mine), 0)]
+
+                for shard in mine + draining:
+                    self.store.execute(
+                        "INSERT INTO leases (shard, owner, expires_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(shard) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at",
+                        (shard, self.worker_id, expires),
+                    )
+                self.store.execute("COMMIT")
+            except BaseException:
+                self.store.execute("ROLLBACK")
+                raise
+            with self.busy_lock:
+                acquired_at = time.monotonic()
+                self.acquired = {shard: self.acquired.get(shard, acquired_at) for shard in mine + draining}
+                self.owned = set(mine)
+                self.draining = set(draining)
+        return self.owned
+
+    def owns(self, note_id: str) -> bool:
+        return shard_of(note_id, self.shards) in self.owned
+
+    def begin(self, note_id: str, since: Optional[float] = None) -> bool:
+        """
+        派工前呼叫：筆記屬於本 worker 持有（且不是 draining）的分片時登記為處理中並回傳 True。
+        since 為開始列出筆記的 time.monotonic()，之後才認領的分片不派工。
+        """
+        shard = shard_of(note_id, self.shards)
+        with self.busy_lock:
+            if shard not in self.owned:
+                return False
+            if since is not None and self.acquired.get(shard, since) > since:
+                return False
+            self.busy[shard] = self.busy.get(shard, 0) + 1
+            return True
+
+    def end(self, note_id: str):
+        """begin() 登記的筆記處理完成。"""
+        shard = shard_of(note_id, self.shards)
+        with self.busy_lock:
+            count = self.busy.get(shard, 0) - 1
+            if count > 0:
+                self.busy[shard] = count
+            else:
+                self.busy.pop(shard, None)
+
+    @property
+    def renewing(self) -> bool:
+        return self.renewal is not None
+
+    def start_renewal(self, interval: float):
+        """在背景每 interval 秒（最多 ttl / 3）續約並重新分配。"""
+        if self.renewal:
+            return
+        self.stop_renew.clear()
+        self.renewal = threading.Thread(target=self._renew, args=(min(interval, self.ttl / 3),),
+                                        name="lease-renewal", daemon=True)
+        self.renewal.start()
+
+    def stop_renewal(self):
+        if self.renewal:
+            self.stop_renew.set()
+            self.renewal.join()
+            self.renewal = None
+
+    def _renew(self, interval: float):
+        # 超過 ttl 無法續約時放棄所有分片，避免與接手的 worker 重複處理
+        renewed = time.monotonic()
+        while not self.stop_renew.wait(interval):
+            try:
+                self.claim()
+                renewed = time.monotonic()
+            except sqlite3.Error as e:
+                print (f"⚠️ 無法續約 lease: {e}")
+                if time.monotonic() - renewed > self.ttl:
+                    with self.busy_lock:
+                        self.owned = set()
+                        self.draining = set()
+
+    def release(self):
+        """停止續約並釋出本 worker 持有的所有 lease，讓其他 worker 立即接手。"""
+        self.stop_renewal()
+        with self.store.lock:
+            self.store.execute("DELETE FROM leases WHERE owner = ?", (self.worker_id,))
+            self.store.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+            self.owned = set()
+            self.draining = set()
+            self.acquired = {}
+
+
+_store: Optional[StateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> StateStore:
+    """取得共用的 StateStore（第一次呼叫時開啟）。"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore()
+        return _store
+
+
+_leases: Optional[ShardLeases] = None
+_leases_lock = threading.Lock()
+
+
+def get_leases() -> Optional[ShardLeases]:
+    """
+    分片模式（SHARDS > 1）時取得本 worker 的 lease。LEASE_DB 與 STATE_DB 不同時另外開啟，
+    且不使用 WAL，以便放在多台主機共用的 volume 上。
+    """
+    global _leases
+    if SHARDS <= 1:
+        return None
+    with _leases_lock:
+        if _leases is None:
+            store = get_store() if LEASE_DB == STATE_DB else StateStore(LEASE_DB, wal=False)
+            _leases = ShardLeases(store)
+        return _leases
@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from accounts import load_accounts
+
+# 單一帳號部署（joplin2readeck-secret.yaml）的環境變數
+SINGLE_ACCOUNT_ENV = {
+    'JOPLIN_DATA_API_TOKEN': 'ownerjoplintoken',
+    'JOPLIN_PASSWORD': 'ownerpassword',
+    'READECK_URL': 'https://readeck.owner.example.com',
+    'READECK_TOKEN': 'ownertoken',
+    'INSTAPAPER_USERNAME': 'owner@example.com',
+    'INSTAPAPER_PASSWORD': 'ownerpassword',
+    'NOTES_URL': 'https://notes.example.com',
+    'INBOX': 'inbox',
+}
+
+ACCOUNT = '''
+[[accounts]]
+name = "amy"
+api_url = "http://joplin-amy:41184"
+api_token = "amytoken"
+server_url = "https://joplin.example.com"
+user = "amy@example.com"
+password = "amypassword"
+'''
+
+
+class LoadAccountsTest(unittest.TestCase):
+    def load(self, text, env=SINGLE_ACCOUNT_ENV):
+        with tempfile.NamedTemporaryFile('w', suffix='.toml', delete=False) as f:
+            f.write(text)
+        self.addCleanup(os.unlink, f.name)
+        with mock.patch.dict(os.environ, env, clear=True):
+            return load_accounts(f.name)
+
+    def test_destinations_do_not_fall_back_to_env(self):
+        amy, = self.load(ACCOUNT)
+        self.assertIsNone(amy.readeck_url)
+        self.assertIsNone(amy.readeck_token)
+        self.assertIsNone(amy.instapaper_username)
+        self.assertIsNone(amy.instapaper_password)
+        # 非機密的欄位仍可使用環境變數
+        self.assertEqual(amy.notes_url, 'https://notes.example.com')
+        self.assertEqual(amy.inbox, 'inbox')
+
+    def test_credentials_do_not_fall_back_to_env(self):
+        with self.assertRaisesRegex(ValueError, 'missing api_token, password'):
+            self.load(ACCOUNT.replace('api_token = "amytoken"\n', '').replace('password = "amypassword"\n', ''))
+
+    def test_defaults_and_env_references(self):
+        amy, = self.load('[defaults]\nreadeck_url = "https://readeck.example.com"\n' + ACCOUNT
+                         + 'readeck_token = "${READECK_TOKEN_AMY}"\n',
+                         dict(SINGLE_ACCOUNT_ENV, READECK_TOKEN_AMY='amyreadeck'))
+        self.assertEqual(amy.readeck_url, 'https://readeck.example.com')
+        self.assertEqual(amy.readeck_token, 'amyreadeck')
+
+    def test_unset_env_reference_fails(self):
+        with self.assertRaisesRegex(ValueError, 'READECK_TOKEN_AMY'):
+            self.load('[defaults]\nreadeck_url = "https://readeck.example.com"\n' + ACCOUNT
+                      + 'readeck_token = "${READECK_TOKEN_AMY}"\n')
+
+    def test_incomplete_destination_fails(self):
+        with self.assertRaisesRegex(ValueError, 'no readeck_url'):
+            self.load(ACCOUNT + 'readeck_token = "amyreadeck"\n')
+        with self.assertRaisesRegex(ValueError, 'instapaper_password'):
+            self.load(ACCOUNT + 'instapaper_username = "amy@example.com"\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from labels import LabelEngine, compute_labels
+
+WEEK = "20251003"
+
+
+class ComputeLabelsTest(unittest.TestCase):
+    def test_week_label_only(self):
+        self.assertEqual(compute_labels([], WEEK), [WEEK])
+
+    def test_sorted_and_deduplicated(self):
+        self.assertEqual(compute_labels(["python", " go ", "python", ""], WEEK), ["go", "python", WEEK])
+
+    def test_yearmonth_and_week_tags_are_skipped(self):
+        self.assertEqual(compute_labels(["202510", WEEK, "news"], WEEK), ["news", WEEK])
+
+    def test_label_count_is_bounded(self):
+        tags = [f"tag{i:03d}" for i in range(100)]
+        labels = compute_labels(tags, WEEK, max_labels=5)
+        self.assertEqual(labels, ["tag000", "tag001", "tag002", "tag003", WEEK])
+
+    def test_label_length_is_bounded(self):
+        self.assertEqual(compute_labels(["x" * 100], WEEK, max_length=10), ["x" * 10, WEEK])
+
+    def test_order_does_not_matter(self):
+        self.assertEqual(compute_labels(["b", "a", "c"], WEEK), compute_labels(["c", "b", "a"], WEEK))
+
+
+class LabelEngineTest(unittest.TestCase):
+    def test_payload_size_does_not_grow(self):
+        engine = LabelEngine(lambda: {}, WEEK)
+        payloads = [json.dumps({"url": f"https://n/{i}", "labels": engine.labels(str(i))}) for i in range(1000)]
+        # URL 長度不同，labels 部分每篇都相同
+        self.assertEqual(len(payloads[10]), len(payloads[99]))
+        self.assertEqual(len(payloads[100]), len(payloads[999]))
+        self.assertEqual(engine.labels("999"), [WEEK])
+
+    def test_payload_size_is_fixed_per_tag_set(self):
+        engine = LabelEngine(lambda: {"a": ["x", "y"], "b": ["y", "x"]}, WEEK, max_labels=3)
+        for _ in range(100):
+            self.assertEqual(engine.labels("a"), ["x", "y", WEEK])
+        self.assertEqual(engine.labels("a"), engine.labels("b"))
+
+    def test_tags_are_loaded_once(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            return {"a": ["x"]}
+
+        engine = LabelEngine(load, WEEK)
+        for note_id in ("a", "b", "a"):
+            engine.labels(note_id)
+        self.assertEqual(len(calls), 1)
+
+    def engine_with_note_loader(self, tag_count):
+        self.bulk_calls = []
+        self.note_calls = []
+
+        def load():
+            self.bulk_calls.append(1)
+            return {"a": ["x"], "b": ["y"], "c": ["z"]}
+
+        def load_note(note_id):
+            self.note_calls.append(note_id)
+            return {"a": ["x"], "b": ["y"], "c": ["z"]}.get(note_id, [])
+
+        return LabelEngine(load, WEEK, load_note_tags=load_note, tag_count=lambda: tag_count)
+
+    def test_small_batch_uses_per_note_lookup(self):
+        engine = self.engine_with_note_loader(tag_count=50)
+        self.assertEqual(engine.labels("a"), ["x", WEEK])
+        self.assertEqual(engine.labels("b"), ["y", WEEK])
+        self.assertEqual(self.note_calls, ["a", "b"])
+        self.assertEqual(self.bulk_calls, [])
+
+    def test_per_note_lookup_is_cached(self):
+        engine = self.engine_with_note_loader(tag_count=50)
+        for _ in range(3):
+            engine.labels("a")
+        self.assertEqual(self.note_calls, ["a"])
+
+    def test_large_batch_switches_to_bulk_load(self):
+        engine = self.engine_with_note_loader(tag_count=2)
+        for note_id in ("a", "b", "c", "d", "a"):
+            engine.labels(note_id)
+        self.assertEqual(self.note_calls, ["a", "b"])
+        self.assertEqual(len(self.bulk_calls), 1)
+        self.assertEqual(engine.labels("c"), ["z", WEEK])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state import ShardLeases, StateStore, shard_of
+
+SHARDS = 12
+
+
+def note_in(shard: int, shards: int = SHARDS) -> str:
+    """回傳落在指定分片的 note ID。"""
+    n = 0
+    while shard_of(f"note{n}", shards) != shard:
+        n += 1
+    return f"note{n}"
+
+
+class ShardLeasesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = StateStore(os.path.join(self.dir.name, "leases.db"))
+
+    def tearDown(self):
+        self.store.conn.close()
+        self.dir.cleanup()
+
+    def worker(self, name, ttl=60.0):
+        return ShardLeases(self.store, name, SHARDS, ttl)
+
+    def test_single_worker_claims_all_shards(self):
+        a = self.worker("a")
+        self.assertEqual(a.claim(), set(range(SHARDS)))
+
+    def test_split_between_joined_workers(self):
+        a, b, c = self.worker("a"), self.worker("b"), self.worker("c")
+        for w in (a, b, c):
+            w.join()
+        for w in (a, b, c):
+            w.claim()
+        self.assertEqual([len(w.owned) for w in (a, b, c)], [4, 4, 4])
+        self.assertEqual(a.owned | b.owned | c.owned, set(range(SHARDS)))
+        self.assertFalse(a.owned & b.owned or a.owned & c.owned or b.owned & c.owned)
+
+    def test_new_worker_takes_released_extra_shards(self):
+        a, b = self.worker("a"), self.worker("b")
+        a.claim()
+        b.join()
+        a.claim()
+        self.assertEqual(len(a.owned), SHARDS // 2)
+        b.claim()
+        self.assertEqual(b.owned, set(range(SHARDS)) - a.owned)
+
+    def test_release_hands_shards_over(self):
+        a, b = self.worker("a"), self.worker("b")
+        a.join()
+        b.join()
+        a.claim()
+        b.claim()
+        a.release()
+        self.assertEqual(a.owned, set())
+        self.assertEqual(b.claim(), set(range(SHARDS)))
+
+    def test_expired_worker_is_taken_over(self):
+        a, b = self.worker("a", ttl=0.2), self.worker("b", ttl=0.2)
+        a.join()
+        b.join()
+        a.claim()
+        b.claim()
+        time.sleep(0.3)
+        # a 沒有續約：lease 與 heartbeat 都過期，b 接手全部分片
+        self.assertEqual(b.claim(), set(range(SHARDS)))
+
+    def test_begin_only_for_owned_shards(self):
+        a, b = self.worker("a"), self.worker("b")
+        a.join()
+        b.join()
+        a.claim()
+        b.claim()
+        mine = note_in(min(a.owned))
+        other = note_in(min(b.owned))
+        self.assertTrue(a.begin(mine))
+        self.assertFalse(a.begin(other))
+        a.end(mine)
+        self.assertEqual(a.busy, {})
+
+    def test_busy_shard_is_kept_until_notes_finish(self):
+        a, b = self.worker("a"), self.worker("b")
+        a.claim()
+        # a 持有全部分片時派出每個分片的一篇筆記
+        notes = [note_in(shard) for shard in range(SHARDS)]
+        for note_id in notes:
+            self.assertTrue(a.begin(note_id))
+
+        b.join()
+        a.claim()
+        self.assertEqual(len(a.owned), SHARDS // 2)
+        self.assertEqual(a.draining, set(range(SHARDS)) - a.owned)
+        # draining 的分片不再派出新的筆記，也不會被 b 認領
+        self.assertFalse(a.begin(note_in(min(a.draining))))
+        self.assertEqual(b.claim(), set())
+
+        for note_id in notes:
+            a.end(note_id)
+        a.claim()
+        self.assertEqual(a.draining, set())
+        self.assertEqual(b.claim(), set(range(SHARDS)) - a.owned)
+
+    def test_shards_acquired_after_listing_wait_for_next_listing(self):
+        a, b = self.worker("a"), self.worker("b")
+        a.join()
+        b.join()
+        a.claim()
+        listed_at = time.monotonic()
+        time.sleep(0.01)
+        b.claim()
+        mine = note_in(min(b.owned))
+        # b 接手前列出的筆記可能已被 a 處理完，下一次列出時才派工
+        self.assertFalse(b.begin(mine, listed_at))
+        self.assertTrue(b.begin(mine, time.monotonic()))
+        # 列出前就持有的分片照常派工
+        self.assertTrue(a.begin(note_in(min(a.owned)), listed_at))
+
+    def test_idle_workers_keep_shards_while_renewing(self):
+        a, b = self.worker("a", ttl=0.3), self.worker("b", ttl=0.3)
+        a.join()
+        b.join()
+        a.claim()
+        b.claim()
+        owned = (set(a.owned), set(b.owned))
+        a.start_renewal(0.05)
+        b.start_renewal(0.05)
+        self.addCleanup(a.stop_renewal)
+        self.addCleanup(b.stop_renewal)
+        # 兩個 worker 都閒置超過 ttl：背景續約讓 heartbeat 與 lease 都不過期
+        time.sleep(1.0)
+        self.assertEqual((a.claim(), b.claim()), owned)
+        self.assertEqual(self.store.execute("SELECT COUNT(*) FROM workers").fetchone()[0], 2)
+
+    def test_release_stops_renewal(self):
+        a, b = self.worker("a", ttl=0.3), self.worker("b", ttl=0.3)
+        a.join()
+        b.join()
+        a.claim()
+        a.start_renewal(0.05)
+        a.release()
+        self.assertFalse(a.renewing)
+        time.sleep(0.1)
+        self.assertEqual(b.claim(), set(range(SHARDS)))
+
+
+if __name__ == "__main__":
+    unittest.main()
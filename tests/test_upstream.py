@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import upstream
+from upstream import AdaptiveLimiter, get_breaker
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def test_light_load_does_not_raise_limit(self):
+        limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=10)
+        for _ in range(200):
+            saturated = limiter.acquire()
+            limiter.release(0.01, 200, saturated=saturated)
+        self.assertFalse(saturated)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_saturated_limiter_increases_additively(self):
+        limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=10)
+        for _ in range(3):
+            # 每一輪送滿目前的上限
+            held = [limiter.acquire() for _ in range(int(limiter.limit))]
+            self.assertTrue(held[-1])
+            for saturated in held:
+                limiter.release(0.01, 200, saturated=saturated)
+        self.assertGreater(limiter.limit, 2)
+        self.assertLess(limiter.limit, 10)
+
+    def test_errors_decrease_multiplicatively(self):
+        limiter = AdaptiveLimiter(initial=8, minimum=1, maximum=10)
+        saturated = limiter.acquire()
+        limiter.release(0.01, 503, saturated=saturated)
+        self.assertEqual(limiter.limit, 4)
+
+
+
+class BreakerOverrideTest(unittest.TestCase):
+    def setUp(self):
+        breakers = dict(upstream._breakers)
+        self.addCleanup(lambda: (upstream._breakers.clear(), upstream._breakers.update(breakers)))
+        upstream._breakers.clear()
+
+    def test_account_breaker_uses_base_name_override(self):
+        with mock.patch.dict(os.environ, {"BREAKER_FAILURES_READECK": "2", "BREAKER_COOLDOWN_READECK": "7"}):
+            breaker = get_breaker("readeck:amy")
+        self.assertEqual((breaker.failures, breaker.cooldown), (2, 7.0))
+
+    def test_account_override_wins_over_base_name(self):
+        with mock.patch.dict(os.environ, {"BREAKER_FAILURES_READECK": "2", "BREAKER_FAILURES_READECK_AMY_2": "9"}):
+            self.assertEqual(get_breaker("readeck:amy-2").failures, 9)
+            self.assertEqual(get_breaker("readeck:dany").failures, 2)
+            self.assertEqual(get_breaker("readeck").failures, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
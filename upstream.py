@@ -0,0 +1,434 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from metrics import get_metrics
+
+# 連線池與逾時設定，可用 HTTP_POOL_SIZE_<NAME> 針對單一上游覆寫（例：HTTP_POOL_SIZE_READECK=4）
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+
+# AIMD 並行上限：初始值、上下限與調整參數，可用 HTTP_CONCURRENCY_<NAME> 等覆寫
+HTTP_CONCURRENCY = int(os.getenv("HTTP_CONCURRENCY", "4"))
+HTTP_CONCURRENCY_MIN = int(os.getenv("HTTP_CONCURRENCY_MIN", "1"))
+HTTP_CONCURRENCY_MAX = int(os.getenv("HTTP_CONCURRENCY_MAX", str(HTTP_POOL_SIZE)))
+AIMD_DECREASE = float(os.getenv("AIMD_DECREASE", "0.5"))
+AIMD_LATENCY_SPIKE = float(os.getenv("AIMD_LATENCY_SPIKE", "3"))
+# 429 沒有 Retry-After 時的等待秒數與最多重送次數
+RETRY_AFTER_DEFAULT = float(os.getenv("RETRY_AFTER_DEFAULT", "5"))
+RETRY_AFTER_MAX = float(os.getenv("RETRY_AFTER_MAX", "60"))
+
+# 每個上游每秒最多送出的請求數（0 為不限制），可用 HTTP_RATE_<NAME> 覆寫
+HTTP_RATE = float(os.getenv("HTTP_RATE", "0"))
+
+# circuit breaker：連續失敗幾次後開路、開路多久後放行一個試探請求（秒），
+# 可用 BREAKER_FAILURES_<NAME> 或帳號的 BREAKER_FAILURES_<NAME>_<ACCOUNT> 覆寫（例：BREAKER_FAILURES_READECK_AMY）
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+
+# 只有冪等的請求才會自動重試；POST（建立 tag、share、bookmark）不重試以免重複建立
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+RETRY_STATUS = (500, 502, 503, 504)
+
+
+class TransientHTTPError(requests.RequestException):
+    """上游暫時無法處理（429、5xx）；呼叫端應保留筆記下次再試，而不是視為永久失敗。"""
+
+
+class CircuitOpenError(requests.RequestException):
+    """目的地的 circuit breaker 為開路狀態，本次不送出請求。"""
+
+
+def raise_for_transient(response: requests.Response):
+    if response.status_code == 429 or response.status_code >= 500:
+        raise TransientHTTPError(f"{response.status_code} from {response.url}", response=response)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After（秒數或 HTTP 日期）。"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    以 AIMD 調整的並行上限。
+
+    延遲正常時每完成一輪（約 limit 個請求）上限加 1；只計入送出時已達上限（in_flight == limit）
+    的請求，負載低於上限時不會一路加到 maximum。遇到 429、5xx、連線錯誤或延遲超過平均的
+    AIMD_LATENCY_SPIKE 倍時乘以 AIMD_DECREASE（同一個 RTT 內只降一次）。
+    收到 429 時依 Retry-After 暫停所有新請求。
+
+    Args:
+        initial (int): 初始並行數
+        minimum (int): 下限
+        maximum (int): 上限
+    """
+
+    def __init__(self, initial: int = HTTP_CONCURRENCY, minimum: int = HTTP_CONCURRENCY_MIN,
+                 maximum: int = HTTP_CONCURRENCY_MAX):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.decreases = 0
+        self.cond = threading.Condition()
+
+    def acquire(self) -> bool:
+        """取得一個並行名額；回傳送出時是否已達上限（saturated），完成時傳給 release()。"""
+        with self.cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return self.in_flight >= int(self.limit)
+                self.cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, seconds: float, status: Optional[int], retry_after: Optional[float] = None,
+                saturated: bool = False):
+        with self.cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status == 429:
+                self.throttled += 1
+                pause = RETRY_AFTER_DEFAULT if retry_after is None else min(retry_after, RETRY_AFTER_MAX)
+                self.paused_until = max(self.paused_until, now + pause)
+                self._decrease(now)
+            elif status is None or status >= 500:
+                self._decrease(now)
+            else:
+                if self.latency is not None and seconds > self.latency * AIMD_LATENCY_SPIKE:
+                    self._decrease(now)
+                elif saturated:
+                    self.limit = min(self.limit + 1.0 / self.limit, float(self.maximum))
+                self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+            self.cond.notify_all()
+
+    def _decrease(self, now: float):
+        # 同一批併發請求一起失敗時只算一次
+        if now - self.last_decrease < (self.latency or 0.0):
+            return
+        self.last_decrease = now
+        self.decreases += 1
+        self.limit = max(self.limit * AIMD_DECREASE, float(self.minimum))
+
+
+class RateLimiter:
+    """
+    token bucket：平均每秒最多 rate 個請求，最多連續送出 burst 個。rate 為 0 時不限制。
+
+    Args:
+        rate (float): 每秒請求數
+        burst (float, optional): 可累積的請求數，預設與 rate 相同（至少 1）
+    """
+
+    def __init__(self, rate: float = 0.0, burst: Optional[float] = None):
+        self.lock = threading.Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: Optional[float] = None):
+        with self.lock:
+            self.rate = max(rate, 0.0)
+            self.burst = max(self.rate if burst is None else burst, 1.0)
+            self.tokens = self.burst
+            self.updated = time.monotonic()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if self.rate <= 0:
+                    return
+                now = time.monotonic()
+                self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    單一目的地的 circuit breaker。
+
+    連續 failures 次失敗後開路，cooldown 秒內 allow() 一律回傳 False；之後進入半開，
+    一次只放行一個試探請求，成功即關閉，失敗則重新開路。
+
+    Args:
+        name (str): 目的地名稱
+        failures (int): 開路前允許的連續失敗次數
+        cooldown (float): 開路後多久放行試探請求（秒）
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.failures = max(failures, 1)
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """開路且仍在 cooldown 內（不佔用試探名額）。"""
+        with self.lock:
+            return self.state != self.CLOSED and (
+                self.probing or time.monotonic() - self.opened_at < self.cooldown)
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self.probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                print(f"circuit {self.name}: closed")
+            self.state = self.CLOSED
+            self.consecutive = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.consecutive >= self.failures):
+                if self.state == self.CLOSED:
+                    print(f"circuit {self.name}: open after {self.consecutive} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.opened += 1
+            self.probing = False
+
+
+def _env_override(name: str, key: str, default):
+    """
+    依序查 {key}_{NAME}、{key}_{BASE} 的環境變數。帳號的 breaker 名稱為 base:account
+    （例：readeck:amy → BREAKER_FAILURES_READECK_AMY，再來是 BREAKER_FAILURES_READECK），
+    非英數字元換成底線，才能設為環境變數。
+    """
+    base = name.split(":", 1)[0]
+    for suffix in dict.fromkeys((name, base)):
+        value = os.getenv(f"{key}_{re.sub(r'[^0-9A-Za-z]', '_', suffix).upper()}")
+        if value is not None:
+            return type(default)(value)
+    return default
+
+
+class Upstream:
+    """
+    單一上游服務的 HTTP client，持有一個 keep-alive 的連線池。
+
+    Args:
+        name (str): 上游名稱，例如 joplin、joplin_server、readeck、instapaper
+        pool_size (int): 每個 host 最多保留的連線數
+        timeout (Tuple[float, float]): (connect, read) 逾時秒數
+        retries (int): 冪等請求遇到連線錯誤或 5xx 時的重試次數
+        backoff (float): 重試的 exponential backoff 係數
+        limiter (AdaptiveLimiter): 並行上限，預設上限為 pool_size
+        rate (float): 每秒最多送出的請求數（含 429 重送），0 為不限制
+
+    429 一律依 Retry-After 等待後重送（伺服器未處理該請求，POST 也安全）。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        pool_size: int = HTTP_POOL_SIZE,
+        timeout: Tuple[float, float] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF,
+        limiter: Optional[AdaptiveLimiter] = None,
+        rate: float = HTTP_RATE,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.limiter = limiter or AdaptiveLimiter(maximum=pool_size)
+        self.rate = RateLimiter(rate)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            self.rate.acquire()
+            saturated = self.limiter.acquire()
+            start = time.monotonic()
+            status = None
+            retry_after = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+                status = response.status_code
+                if status == 429:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            finally:
+                seconds = time.monotonic() - start
+                self.limiter.release(seconds, status, retry_after, saturated)
+                get_metrics().observe_request(self.name, method, url, status, seconds)
+
+            if status != 429 or attempt >= self.retries:
+                return response
+            attempt += 1
+            response.close()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        """回傳此上游的請求數、新建連線數與重用次數。"""
+        pools = self.adapter.poolmanager.pools
+        requests_sent = 0
+        connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+        return {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": max(requests_sent - connections, 0),
+            "concurrency": int(self.limiter.limit),
+            "throttled": self.limiter.throttled,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_upstreams: Dict[Tuple[str, str], Upstream] = {}
+_lock = threading.Lock()
+# set_rate() 設定的速率，之後才建立的上游也套用；None 時依 HTTP_RATE 設定
+_rate: Optional[float] = None
+
+
+def get_upstream(name: str, base_url: Optional[str] = None) -> Upstream:
+    """
+    取得（必要時建立）指定服務與 host 的共用 Upstream。
+
+    以 (name, host) 為 key：只有指向同一個實例的帳號共用連線池、並行上限與速率限制；
+    環境變數覆寫仍以服務名稱設定，套用到該服務的所有 host。
+
+    Args:
+        name (str): 上游名稱，例如 joplin、joplin_server、readeck、instapaper
+        base_url (str, optional): 上游 URL（只取 host:port），未提供時為該服務的預設上游
+    """
+    key = (name, urlsplit(base_url).netloc if base_url else "")
+    with _lock:
+        upstream = _upstreams.get(key)
+        if upstream is None:
+            upstream = Upstream(
+                name,
+                pool_size=_env_override(name, "HTTP_POOL_SIZE", HTTP_POOL_SIZE),
+                timeout=(
+                    _env_override(name, "HTTP_CONNECT_TIMEOUT", HTTP_CONNECT_TIMEOUT),
+                    _env_override(name, "HTTP_READ_TIMEOUT", HTTP_READ_TIMEOUT),
+                ),
+                retries=_env_override(name, "HTTP_RETRIES", HTTP_RETRIES),
+                backoff=_env_override(name, "HTTP_BACKOFF", HTTP_BACKOFF),
+                limiter=AdaptiveLimiter(
+                    initial=_env_override(name, "HTTP_CONCURRENCY", HTTP_CONCURRENCY),
+                    minimum=_env_override(name, "HTTP_CONCURRENCY_MIN", HTTP_CONCURRENCY_MIN),
+                    maximum=_env_override(name, "HTTP_CONCURRENCY_MAX", HTTP_CONCURRENCY_MAX),
+                ),
+                rate=_env_override(name, "HTTP_RATE", HTTP_RATE) if _rate is None else _rate,
+            )
+            _upstreams[key] = upstream
+        return upstream
+
+
+def set_rate(rate: float):
+    """把所有上游（含之後才建立的）改為每秒最多 rate 個請求（0 為不限制）。"""
+    global _rate
+    with _lock:
+        _rate = rate
+        for upstream in _upstreams.values():
+            upstream.rate.set_rate(rate)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """取得指定目的地的共用 circuit breaker（daemon 模式下跨輪保留狀態）。"""
+    with _lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failures=_env_override(name, "BREAKER_FAILURES", BREAKER_FAILURES),
+                cooldown=_env_override(name, "BREAKER_COOLDOWN", BREAKER_COOLDOWN),
+            )
+            _breakers[name] = breaker
+        return breaker
+
+
+def connection_report() -> Dict[str, Dict[str, int]]:
+    """所有上游的連線重用統計。"""
+    with _lock:
+        return {f"{name} {host}" if host else name: upstream.stats()
+                for (name, host), upstream in _upstreams.items()}
+
+
+def print_connection_report():
+    for name, s in connection_report().items():
+        print(f"{name}:\trequests {s['requests']}\tconnections {s['connections']}\treused {s['reused']}"
+              f"\tconcurrency {s['concurrency']}\tthrottled {s['throttled']}")